@@ -0,0 +1,175 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmarks the HTTP streaming path (routes -> ParallelTransferrer -> DCConnectionManager)
+# against an in-process stand-in for Telegram's upload.getFile, so changes to the engine can
+# be compared without real bots.
+#
+#   python bench/bench_stream.py --bots 4 --clients 64 --requests 512 --latency 0.05
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Dict, List
+
+for key, value in {"API_ID": "1", "API_HASH": "bench", "BOT_TOKEN": "0:bench", "BIN_CHANNEL": "-1",
+                   "PREWARM_CONNECTIONS": "0"}.items():
+    os.environ.setdefault(key, value)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+# Importing tgfs.telegram creates a session file in the working directory
+os.chdir(tempfile.mkdtemp(prefix="tgfs-bench-"))
+
+# pylint: disable=wrong-import-position,protected-access
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+from telethon.tl.types import InputDocumentFileLocation
+
+from bench.fakes import BENCH_DC, FakeClient, FakeDC, FakeDCConnectionManager
+from tgfs import metrics
+from tgfs.file_store import file_store
+from tgfs.paralleltransfer import ParallelTransferrer
+from tgfs.profiling import monitor_loop_lag
+from tgfs.routes import routes
+from tgfs.telegram import multi_clients
+from tgfs.utils import FileInfo
+
+
+async def setup(args: argparse.Namespace) -> FakeDC:
+    dc = FakeDC(args)
+    multi_clients.clear()
+    for bot_id in range(1, args.bots + 1):
+        transfer = ParallelTransferrer(FakeClient(dc), bot_id)
+        transfer.dc_managers = {dc_id: FakeDCConnectionManager(transfer.client, dc_id, transfer.log)
+                                for dc_id in transfer.dc_managers}
+        transfer.post_init()
+        multi_clients[bot_id] = transfer
+        for msg_id in range(1, args.files + 1):
+            location = InputDocumentFileLocation(msg_id, bot_id, b"", "")
+            await file_store.put(msg_id, bot_id, FileInfo(args.file_size, "video/mp4", f"{msg_id}.mp4",
+                                                          msg_id, BENCH_DC, location))
+    return dc
+
+
+async def client_worker(session: ClientSession, base_url: str, args: argparse.Namespace, data: bytes,
+                        queue: "asyncio.Queue[int]", ttfb: List[float], served: Dict[str, int]) -> None:
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        msg_id = random.randint(1, args.files)
+        start = random.randrange(args.file_size)
+        end = args.file_size - 1 if random.random() < args.sequential else \
+            min(args.file_size - 1, start + random.randint(1, args.range_size) - 1)
+        began = time.monotonic()
+        async with session.get(f"{base_url}/{msg_id}/{msg_id}.mp4",
+                               headers={"Range": f"bytes={start}-{end}"}) as resp:
+            first = True
+            offset = start
+            async for chunk in resp.content.iter_any():
+                if first:
+                    ttfb.append(time.monotonic() - began)
+                    first = False
+                if args.verify and chunk != data[offset:offset + len(chunk)]:
+                    served["corrupt"] += 1
+                offset += len(chunk)
+            served["bytes"] += offset - start
+            if offset != end + 1:
+                served["short"] += 1
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def main(args: argparse.Namespace) -> None:
+    random.seed(args.seed)
+    dc = await setup(args)
+    app = web.Application()
+    app.add_routes(routes)
+    server = TestServer(app)
+    await server.start_server()
+    base_url = str(server.make_url("")).rstrip("/")
+
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+    ttfb: List[float] = []
+    served = {"bytes": 0, "short": 0, "corrupt": 0}
+
+    lag_monitor = asyncio.create_task(monitor_loop_lag(0.05))
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    async with ClientSession() as session:
+        await asyncio.gather(*[client_worker(session, base_url, args, dc.data, queue, ttfb, served)
+                               for _ in range(args.clients)])
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    lag_monitor.cancel()
+    await server.close()
+    for transfer in multi_clients.values():
+        await transfer.close_connection()
+
+    gigabytes = served["bytes"] / 1024 ** 3
+    print(f"requests        {args.requests} over {args.clients} clients, {args.bots} bots")
+    print(f"served          {served['bytes'] / 1024 ** 2:.1f} MiB in {wall:.2f}s"
+          f" ({served['bytes'] / 1024 ** 2 / wall:.1f} MiB/s)")
+    print(f"ttfb            p50 {percentile(ttfb, 50) * 1000:.1f}ms  p99 {percentile(ttfb, 99) * 1000:.1f}ms"
+          f"  mean {statistics.fmean(ttfb) * 1000 if ttfb else 0:.1f}ms")
+    print(f"cpu             {cpu:.2f}s ({cpu / gigabytes if gigabytes else 0:.2f}s per GiB)")
+    lag_samples = sum(metrics.loop_lag.counts.get((), [0]))
+    print(f"loop lag        mean {metrics.loop_lag.sums.get((), 0) / max(1, lag_samples) * 1000:.1f}ms"
+          f" over {lag_samples} samples")
+    print(f"stream waits    {metrics.stream_dc_wait_seconds.sums.get((), 0):.1f}s on the DC,"
+          f" {metrics.stream_backpressure_seconds.sums.get((), 0):.1f}s on clients")
+    print(f"max rss         {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    print(f"getFile calls   {dc.requests} ({dc.floods} flood waits)")
+    print(f"short/corrupt   {served['short']}/{served['corrupt']}")
+    if args.metrics:
+        print(metrics.render())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming path against a fake DC")
+    parser.add_argument("--bots", type=int, default=2)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--file-size", type=int, default=32 * 1024 * 1024)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent HTTP clients")
+    parser.add_argument("--requests", type=int, default=256, help="total range requests")
+    parser.add_argument("--range-size", type=int, default=4 * 1024 * 1024,
+                        help="largest size of a bounded range request")
+    parser.add_argument("--sequential", type=float, default=0.3,
+                        help="share of requests that read until the end of the file")
+    parser.add_argument("--latency", type=float, default=0.03, help="mean getFile latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="standard deviation of the latency")
+    parser.add_argument("--handshake", type=float, default=0.2, help="seconds to open a connection")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="probability of a FloodWaitError")
+    parser.add_argument("--flood-seconds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify", action="store_true", help="compare every byte with the source")
+    parser.add_argument("--metrics", action="store_true", help="print /metrics at the end")
+    asyncio.run(main(parser.parse_args()))
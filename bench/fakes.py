@@ -0,0 +1,85 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# In-process stand-ins for Telegram's upload.getFile and the bots' DC connections, shared by
+# the benchmark and the tests. Importing this module has no side effects beyond importing tgfs,
+# which needs its environment set up first.
+
+# pylint: disable=protected-access
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+from telethon.errors import FloodWaitError
+
+from tgfs.paralleltransfer import Connection, DCConnectionManager
+
+BENCH_DC = 2
+
+
+class FakeDC:
+    def __init__(self, args: argparse.Namespace, data: Optional[bytes] = None) -> None:
+        self.args = args
+        self.data = os.urandom(args.file_size) if data is None else data
+        self.requests = 0
+        self.floods = 0
+        self.fetched: List[Tuple[int, int]] = []
+
+    async def get_file(self, request) -> SimpleNamespace:
+        self.requests += 1
+        self.fetched.append((request.offset, request.limit))
+        await asyncio.sleep(max(0.0, random.gauss(self.args.latency, self.args.jitter)))
+        if random.random() < self.args.flood_rate:
+            self.floods += 1
+            raise FloodWaitError(request, capture=self.args.flood_seconds)
+        return SimpleNamespace(bytes=self.data[request.offset:request.offset + request.limit])
+
+
+class FakeClient:
+    def __init__(self, dc: FakeDC) -> None:
+        self.dc = dc
+        self.session = SimpleNamespace(dc_id=BENCH_DC, auth_key=None)
+
+    async def _call(self, _sender, request, ordered=False, flood_sleep_threshold=None):
+        return await self.dc.get_file(request)
+
+
+class FakeSender:
+    def __init__(self) -> None:
+        self.connected = True
+
+    async def disconnect(self) -> None:
+        self.connected = False
+
+
+class FakeDCConnectionManager(DCConnectionManager):
+    async def _new_connection(self) -> Connection:
+        await asyncio.sleep(self.client.dc.args.handshake)
+        self._conn_index += 1
+        conn = Connection(sender=FakeSender(), log=self.log.getChild(f"conn{self._conn_index}"),
+                          last_used=time.monotonic())
+        self.connections.append(conn)
+        self.warm = True
+        return conn
+
+    async def _is_alive(self, conn: Connection) -> bool:
+        return True
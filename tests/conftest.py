@@ -0,0 +1,68 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import tempfile
+
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable
+
+import pytest
+
+# Config reads these when tgfs is first imported
+for key, value in {"API_ID": "1", "API_HASH": "test", "BOT_TOKEN": "0:test", "BIN_CHANNEL": "-1",
+                   "PREWARM_CONNECTIONS": "0"}.items():
+    os.environ.setdefault(key, value)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Importing tgfs.telegram opens the main bot's session file in the working directory, which
+# stays open for the rest of the run
+with pytest.MonkeyPatch.context() as patch:
+    patch.chdir(tempfile.mkdtemp(prefix="tgfs-tests-"))
+    import tgfs.telegram  # pylint: disable=unused-import
+
+# pylint: disable=wrong-import-position
+from bench.fakes import FakeClient, FakeDC, FakeDCConnectionManager
+from tgfs.paralleltransfer import ParallelTransferrer
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Anything a test writes relative to the working directory stays out of the checkout
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def make_dc() -> Callable[..., FakeDC]:
+    def make(data: bytes, **kwargs) -> FakeDC:
+        args = SimpleNamespace(file_size=len(data), latency=0.0, jitter=0.0, handshake=0.0,
+                               flood_rate=0.0, flood_seconds=0)
+        vars(args).update(kwargs)
+        return FakeDC(args, data)
+    return make
+
+
+@pytest.fixture
+def make_transferrer() -> Callable[..., ParallelTransferrer]:
+    def make(dc: FakeDC, bot_id: int = 1) -> ParallelTransferrer:
+        transfer = ParallelTransferrer(FakeClient(dc), bot_id)
+        transfer.dc_managers = {dc_id: FakeDCConnectionManager(transfer.client, dc_id, transfer.log)
+                                for dc_id in transfer.dc_managers}
+        return transfer
+    return make
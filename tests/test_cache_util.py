@@ -0,0 +1,172 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from types import SimpleNamespace
+from typing import List, Optional
+
+import pytest
+
+from tgfs import cache_util
+from tgfs.cache_util import AsyncLRUCache
+
+
+class Source:
+    def __init__(self) -> None:
+        self.calls: List[tuple] = []
+
+    async def __call__(self, *args, **kwargs) -> Optional[str]:
+        self.calls.append((args, kwargs))
+        await asyncio.sleep(0)
+        if args and args[0] is None:
+            return None
+        return "x" * (args[0] if args and isinstance(args[0], int) else 1)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Only the cache sees this clock, the event loop keeps the real one
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(cache_util, "time", SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def test_keys():
+    async def run():
+        source = Source()
+        cache = AsyncLRUCache(source, None, False)
+        await cache(1, b=2, c=3)
+        await cache(1, c=3, b=2)
+        await cache(1, 2)
+        await cache(1.0, c=3, b=2)
+        assert len(source.calls) == 2
+        assert cache.stats == {"hits": 2, "misses": 2, "evictions": 0, "entries": 2, "bytes": 0}
+
+        by_first = AsyncLRUCache(source, None, True)
+        await by_first(5, "a")
+        await by_first(5, "b")
+        assert len(source.calls) == 3
+        with pytest.raises(ValueError):
+            await by_first()
+    asyncio.run(run())
+
+
+def test_concurrent_calls_share_one_task():
+    async def run():
+        source = Source()
+        cache = AsyncLRUCache(source, None, False)
+        results = await asyncio.gather(*[cache(3) for _ in range(5)])
+        assert results == ["xxx"] * 5
+        assert len(source.calls) == 1
+        assert cache.stats["hits"] == 4
+    asyncio.run(run())
+
+
+def test_ttl(clock):
+    async def run():
+        source = Source()
+        cache = AsyncLRUCache(source, None, False, ttl=10)
+        await cache(1)
+        clock.value += 9.9
+        await cache(1)
+        assert len(source.calls) == 1
+        clock.value += 0.1
+        await cache(1)
+        assert len(source.calls) == 2
+        assert cache.stats["entries"] == 1
+    asyncio.run(run())
+
+
+def test_negative_results(clock):
+    async def run():
+        source = Source()
+        uncached = AsyncLRUCache(source, None, False)
+        assert await uncached(None) is None
+        assert await uncached(None) is None
+        assert len(source.calls) == 2
+        assert uncached.stats["entries"] == 0
+
+        source = Source()
+        cache = AsyncLRUCache(source, None, False, negative_ttl=5)
+        await cache(None)
+        clock.value += 4
+        await cache(None)
+        assert len(source.calls) == 1
+        clock.value += 1
+        await cache(None)
+        assert len(source.calls) == 2
+    asyncio.run(run())
+
+
+def test_errors_are_not_cached():
+    async def run():
+        calls = []
+
+        async def failing(key):
+            calls.append(key)
+            raise OSError(key)
+
+        cache = AsyncLRUCache(failing, None, False)
+        for _ in range(2):
+            with pytest.raises(OSError):
+                await cache(1)
+        assert len(calls) == 2
+        assert cache.stats["entries"] == 0
+    asyncio.run(run())
+
+
+def test_eviction_by_count():
+    async def run():
+        source = Source()
+        cache = AsyncLRUCache(source, 2, False)
+        await cache(1)
+        await cache(2)
+        await cache(1)
+        await cache(3)
+        # 2 was the least recently used
+        assert list(cache.cache) == [(1,), (3,)]
+        assert cache.stats == {"hits": 1, "misses": 3, "evictions": 1, "entries": 2, "bytes": 0}
+    asyncio.run(run())
+
+
+def test_eviction_by_size():
+    async def run():
+        source = Source()
+        cache = AsyncLRUCache(source, None, False, maxbytes=10, sizeof=len)
+        await cache(4)
+        await cache(5)
+        assert cache.stats["bytes"] == 9
+        await cache(3)
+        assert list(cache.cache) == [(5,), (3,)]
+        assert cache.stats["bytes"] == 8
+        assert cache.stats["evictions"] == 1
+
+        cache.invalidate(5)
+        assert cache.stats["bytes"] == 3
+        assert cache.stats["entries"] == 1
+        # Invalidating doesn't count as an eviction
+        assert cache.stats["evictions"] == 1
+
+        # A result larger than maxbytes pushes everything out, itself included
+        await cache(20)
+        assert cache.stats == {"hits": 0, "misses": 4, "evictions": 3, "entries": 0, "bytes": 0}
+
+        await cache(6)
+        cache.cache_clear()
+        assert cache.stats["bytes"] == 0
+        assert cache.stats["entries"] == 0
+    asyncio.run(run())
@@ -0,0 +1,59 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from tgfs.chunk_cache import TEMP_PREFIX, ChunkCache
+
+
+def test_load_leaves_unrelated_files_alone(tmp_path):
+    (tmp_path / "notes.txt").write_text("keep me")
+    (tmp_path / ".bashrc").write_text("keep me too")
+    (tmp_path / "1_2").write_bytes(b"x")
+    (tmp_path / "subdir").mkdir()
+    (tmp_path / "4_5_6").mkdir()
+    (tmp_path / f"{TEMP_PREFIX}dir").mkdir()
+    (tmp_path / f"{TEMP_PREFIX}abc").write_bytes(b"half written")
+    (tmp_path / "1_4096_0").write_bytes(b"a" * 10)
+
+    cache = ChunkCache(str(tmp_path), 1024)
+
+    assert list(cache.entries) == [(1, 4096, 0)]
+    assert cache.size == 10
+    assert sorted(file.name for file in tmp_path.iterdir()) == sorted([
+        "notes.txt", ".bashrc", "1_2", "subdir", "4_5_6", f"{TEMP_PREFIX}dir", "1_4096_0"])
+
+
+def test_shared_cache_keeps_temp_files(tmp_path):
+    (tmp_path / f"{TEMP_PREFIX}abc").write_bytes(b"another worker is writing this")
+    ChunkCache(str(tmp_path), 1024, shared=True)
+    assert (tmp_path / f"{TEMP_PREFIX}abc").exists()
+
+
+def test_put_get_and_evict(tmp_path):
+    async def run():
+        cache = ChunkCache(str(tmp_path), 20)
+        await cache.put((1, 4096, 0), b"a" * 10)
+        await cache.put((1, 4096, 1), b"b" * 10)
+        assert await cache.get((1, 4096, 0)) == b"a" * 10
+        await cache.put((1, 4096, 2), b"c" * 10)
+        # Part 1 was the least recently used
+        assert await cache.get((1, 4096, 1)) is None
+        assert not (tmp_path / "1_4096_1").exists()
+        assert sorted(file.name for file in tmp_path.iterdir()) == ["1_4096_0", "1_4096_2"]
+        reloaded = ChunkCache(str(tmp_path), 20)
+        assert reloaded.size == 20
+    asyncio.run(run())
@@ -0,0 +1,218 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Opens connections through DCConnectionManager's own connect and auth export path, with only
+# the network side of telethon's MTProtoSender stubbed out.
+
+# pylint: disable=protected-access
+
+import asyncio
+import logging
+
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import List, Optional
+
+import pytest
+
+from telethon.crypto import AuthKey
+from telethon.errors import DcIdInvalidError
+from telethon.network import MTProtoSender
+from telethon.tl.functions import InvokeWithLayerRequest, PingRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+
+from tgfs import paralleltransfer
+from tgfs.config import Config
+from tgfs.paralleltransfer import DCConnectionManager
+from tgfs.sender_pool import SenderThread
+
+HOME_KEY = AuthKey(b"\x01" * 256)
+IMPORTED_KEY = AuthKey(b"\x02" * 256)
+
+
+class StubSender(MTProtoSender):
+    created: List["StubSender"] = []
+    fail_connect: Optional[Exception] = None
+    dead = False
+
+    def __init__(self, auth_key, *, loggers) -> None:
+        super().__init__(auth_key, loggers=loggers)
+        self.connection = None
+        self.sent = []
+        self.loop = None
+        self.closed = False
+        StubSender.created.append(self)
+
+    async def connect(self, connection) -> None:
+        self.loop = asyncio.get_running_loop()
+        if self.fail_connect:
+            raise self.fail_connect
+        self.connection = connection
+        self._user_connected = True
+
+    async def disconnect(self) -> None:
+        self.closed = True
+        self._user_connected = False
+
+    async def send(self, request, ordered=False):
+        self.sent.append(request)
+        if isinstance(request, PingRequest):
+            if self.dead:
+                raise ConnectionError("no pong")
+            return SimpleNamespace(ping_id=request.ping_id)
+        if isinstance(request, InvokeWithLayerRequest):
+            self.auth_key = IMPORTED_KEY
+        return SimpleNamespace(bytes=b"")
+
+
+class StubClient:
+    def __init__(self, export_error: Optional[Exception] = None) -> None:
+        self.session = SimpleNamespace(dc_id=2, auth_key=HOME_KEY)
+        self._log = defaultdict(lambda: logging.getLogger("telethon"))
+        self._proxy = None
+        self._init_request = SimpleNamespace(query=None)
+        self.export_error = export_error
+        self.calls = []
+
+    async def _get_dc(self, dc_id: int):
+        return SimpleNamespace(id=dc_id, ip_address=f"10.0.0.{dc_id}", port=443)
+
+    def _connection(self, ip, port, dc_id, loggers, proxy):
+        return (ip, port, dc_id)
+
+    async def __call__(self, request):
+        self.calls.append(request)
+        if self.export_error:
+            raise self.export_error
+        return SimpleNamespace(id=7, bytes=b"exported")
+
+
+@pytest.fixture(autouse=True)
+def stub_sender(monkeypatch):
+    StubSender.created = []
+    monkeypatch.setattr(paralleltransfer, "MTProtoSender", StubSender)
+    monkeypatch.setattr(StubSender, "fail_connect", None)
+    monkeypatch.setattr(StubSender, "dead", False)
+
+
+def manager(client: StubClient, dc_id: int) -> DCConnectionManager:
+    dcm = DCConnectionManager(client, dc_id, logging.getLogger("test"))
+    if dc_id == client.session.dc_id:
+        # As set up by ParallelTransferrer.post_init
+        dcm.auth_key = client.session.auth_key
+        dcm.warm = True
+    return dcm
+
+
+def test_home_dc_connects_without_export():
+    async def run():
+        client = StubClient()
+        dcm = manager(client, 2)
+        async with dcm.get_connection() as conn:
+            assert conn in dcm.connections
+            assert conn.sender.connection == ("10.0.0.2", 443, 2)
+            assert conn.sender.auth_key is HOME_KEY
+            # Decryption of this sender's responses is timed
+            assert conn.sender._state.decrypt_message_data.__name__ == "timed_decrypt"
+        assert client.calls == []
+        await dcm.disconnect()
+        assert conn.sender.closed
+    asyncio.run(run())
+
+
+def test_foreign_dc_exports_auth_once():
+    async def run():
+        client = StubClient()
+        dcm = manager(client, 4)
+        await dcm.prewarm(2)
+        assert len(dcm.connections) == 2
+        assert [type(call) for call in client.calls] == [ExportAuthorizationRequest]
+        assert client.calls[0].dc_id == 4
+        first, second = StubSender.created
+        imported = first.sent[0]
+        assert isinstance(imported, InvokeWithLayerRequest)
+        assert imported.query.query == ImportAuthorizationRequest(id=7, bytes=b"exported")
+        assert dcm.auth_key is IMPORTED_KEY
+        # Later connections reuse the imported key
+        assert second.auth_key is IMPORTED_KEY and second.sent == []
+        await dcm.disconnect()
+    asyncio.run(run())
+
+
+def test_invalid_dc_falls_back_to_the_session_key():
+    async def run():
+        client = StubClient(DcIdInvalidError(None))
+        dcm = manager(client, 4)
+        async with dcm.get_connection() as conn:
+            assert conn.sender.auth_key is HOME_KEY
+        assert dcm.auth_key is HOME_KEY
+        await dcm.disconnect()
+    asyncio.run(run())
+
+
+def test_failed_connect_is_cleaned_up(monkeypatch):
+    async def run():
+        monkeypatch.setattr(StubSender, "fail_connect", ConnectionRefusedError("refused"))
+        dcm = manager(StubClient(), 2)
+        with pytest.raises(ConnectionRefusedError):
+            async with dcm.get_connection():
+                pass
+        assert dcm.connections == []
+        assert StubSender.created[0].closed
+        # The next request tries again
+        monkeypatch.setattr(StubSender, "fail_connect", None)
+        async with dcm.get_connection() as conn:
+            assert conn.sender is StubSender.created[1]
+        await dcm.disconnect()
+    asyncio.run(run())
+
+
+def test_maintain_pings_and_replaces_dead_connections(monkeypatch):
+    async def run():
+        monkeypatch.setattr(Config, "PREWARM_CONNECTIONS", 1)
+        dcm = manager(StubClient(), 2)
+        await dcm.maintain()
+        conn = dcm.connections[0]
+        await dcm.maintain()
+        assert dcm.connections == [conn]
+        assert sum(isinstance(request, PingRequest) for request in conn.sender.sent) == 1
+        monkeypatch.setattr(StubSender, "dead", True)
+        await dcm.maintain()
+        assert conn.sender.closed
+        assert len(dcm.connections) == 1 and dcm.connections[0] is not conn
+        await dcm.disconnect()
+    asyncio.run(run())
+
+
+def test_connection_on_sender_thread(monkeypatch):
+    async def run():
+        thread = SenderThread("tgfs-test-sender")
+        monkeypatch.setattr(paralleltransfer, "next_sender_thread", lambda: thread)
+        try:
+            client = StubClient()
+            dcm = manager(client, 4)
+            async with dcm.get_connection() as conn:
+                assert conn.thread is thread
+                # Created, connected and authorized on the sender thread's loop
+                assert conn.sender.loop is thread.loop
+                assert dcm.auth_key is IMPORTED_KEY
+                assert await conn.send(PingRequest(1)) == SimpleNamespace(ping_id=1)
+            await dcm.disconnect()
+            assert conn.sender.closed
+        finally:
+            thread.loop.call_soon_threadsafe(thread.loop.stop)
+            thread.thread.join(1)
+    asyncio.run(run())
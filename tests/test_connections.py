@@ -0,0 +1,130 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from typing import List, Set
+
+import pytest
+
+from telethon.tl.types import InputDocumentFileLocation
+
+from tgfs.config import Config
+from tgfs.file_store import file_store
+from tgfs.paralleltransfer import Connection
+from tgfs.utils import FileInfo
+
+
+@pytest.fixture
+def dcm(make_dc, make_transferrer, monkeypatch):
+    monkeypatch.setattr(Config, "PREWARM_CONNECTIONS", 2)
+    monkeypatch.setattr(Config, "CONNECTION_LIMIT", 4)
+    manager = make_transferrer(make_dc(b"")).dc_managers[2]
+    manager.warm = True
+    manager.pinged: List[Connection] = []
+    manager.dead: Set[int] = set()
+    manager.ping_started = None
+    manager.ping_done = None
+
+    async def is_alive(conn: Connection) -> bool:
+        manager.pinged.append(conn)
+        if manager.ping_started is not None:
+            manager.ping_started.set()
+            await manager.ping_done.wait()
+        return id(conn) not in manager.dead
+
+    manager._is_alive = is_alive  # pylint: disable=protected-access
+    return manager
+
+
+def test_tops_up_every_cycle(dcm):
+    async def run():
+        await dcm.maintain()
+        assert len(dcm.connections) == 2
+        # Lost without ever being found dead, e.g. closed as idle before PREWARM_CONNECTIONS was raised
+        dcm.connections.pop()
+        await dcm.maintain()
+        assert len(dcm.connections) == 2
+    asyncio.run(run())
+
+
+def test_cold_dc_is_not_opened(dcm):
+    async def run():
+        dcm.warm = False
+        await dcm.maintain()
+        assert dcm.connections == []
+    asyncio.run(run())
+
+
+def test_prewarms_home_and_stored_dcs(make_dc, make_transferrer, monkeypatch):
+    async def run():
+        monkeypatch.setattr(Config, "PREWARM_CONNECTIONS", 2)
+        await file_store.put(4_000_001, 1, FileInfo(1, "video/mp4", "a.mp4", 4_000_001, 4,
+                                                    InputDocumentFileLocation(1, 1, b"", "")))
+        transfer = make_transferrer(make_dc(b""))
+        transfer.post_init()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        opened = {dc_id: len(dcm.connections) for dc_id, dcm in transfer.dc_managers.items()}
+        assert opened == {1: 0, 2: 2, 3: 0, 4: 2, 5: 0}
+        await transfer.close_connection()
+    asyncio.run(run())
+
+
+def test_only_idle_connections_are_pinged(dcm):
+    async def run():
+        await dcm.prewarm(2)
+        busy, idle = dcm.connections
+        async with dcm.get_connection() as conn:
+            assert conn is busy
+            await dcm.maintain()
+        assert dcm.pinged == [idle]
+    asyncio.run(run())
+
+
+def test_dead_idle_connection_is_replaced(dcm):
+    async def run():
+        await dcm.prewarm(2)
+        dead = dcm.connections[0]
+        dcm.dead.add(id(dead))
+        await dcm.maintain()
+        assert dead not in dcm.connections
+        assert not dead.sender.connected
+        assert len(dcm.connections) == 2
+    asyncio.run(run())
+
+
+def test_connection_in_use_is_closed_after_release(dcm):
+    async def run():
+        await dcm.prewarm(1)
+        conn = dcm.connections[0]
+        dcm.dead.add(id(conn))
+        dcm.ping_started, dcm.ping_done = asyncio.Event(), asyncio.Event()
+        maintenance = asyncio.create_task(dcm.maintain())
+        await dcm.ping_started.wait()
+        # A request takes the connection while its ping is still out
+        async with dcm.get_connection() as used:
+            assert used is conn
+            dcm.ping_started = None
+            dcm.ping_done.set()
+            await maintenance
+            assert conn not in dcm.connections
+            assert conn.retired
+            assert conn.sender.connected
+        await asyncio.sleep(0)
+        assert not conn.sender.connected
+        await dcm.disconnect()
+    asyncio.run(run())
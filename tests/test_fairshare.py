@@ -0,0 +1,175 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from aiohttp.test_utils import make_mocked_request
+from multidict import CIMultiDict
+
+from tgfs import fairshare
+from tgfs.config import Config
+from tgfs.fairshare import FairQueue, Flow, StreamLimiter, TokenBucket
+from tgfs.routes import client_ip
+
+
+async def hold(queue: FairQueue, flow: Flow, name: str, order: List[str], release: asyncio.Event) -> None:
+    async with queue.slot(flow):
+        order.append(name)
+        await release.wait()
+
+
+def test_queue_alternates_between_flows():
+    async def run():
+        queue = FairQueue(1)
+        order: List[str] = []
+        release = asyncio.Event()
+        release.set()
+        busy = asyncio.Event()
+        holder = asyncio.create_task(hold(queue, Flow("c", 1), "holder", order, busy))
+        await asyncio.sleep(0)
+        # a asks for four parts before b asks for two, they still take turns
+        a, b = Flow("a", 1), Flow("b", 2)
+        tasks = []
+        for flow, name in [(a, "a")] * 4 + [(b, "b")] * 2:
+            tasks.append(asyncio.create_task(hold(queue, flow, name, order, release)))
+            await asyncio.sleep(0)
+        assert len(queue.waiting) == 6
+        busy.set()
+        await asyncio.gather(holder, *tasks)
+        assert order == ["holder", "a", "b", "a", "b", "a", "a"]
+        assert queue.active == 0 and not queue.waiting
+    asyncio.run(run())
+
+
+def test_queue_weights_streams_by_ip(monkeypatch):
+    async def run():
+        limiter = StreamLimiter()
+        monkeypatch.setattr(fairshare, "stream_limiter", limiter)
+        # Two streams from one IP share what a single stream from another gets
+        flows = [limiter.open("a", 1), limiter.open("a", 2), limiter.open("b", 3)]
+        queue = FairQueue(1)
+        order: List[str] = []
+        release, busy = asyncio.Event(), asyncio.Event()
+        release.set()
+        holder = asyncio.create_task(hold(queue, flows[2], "holder", order, busy))
+        await asyncio.sleep(0)
+        tasks = []
+        for flow in flows * 3:
+            tasks.append(asyncio.create_task(hold(queue, flow, flow.ip, order, release)))
+            await asyncio.sleep(0)
+        busy.set()
+        await asyncio.gather(holder, *tasks)
+        # b's requests are tagged 1, 2, 3 and each of a's streams' 2, 4, 6
+        assert order[1:7].count("b") == 3
+        assert order[7:] == ["a", "a", "a"]
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_no_trace():
+    async def run():
+        queue = FairQueue(1)
+        order: List[str] = []
+        release = asyncio.Event()
+        release.set()
+        holder = queue.slot(Flow("a", 1))
+        await holder.__aenter__()
+        waiter = asyncio.create_task(hold(queue, Flow("b", 1), "cancelled", order, release))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await holder.__aexit__(None, None, None)
+        assert order == []
+        assert queue.active == 0 and not queue.waiting
+    asyncio.run(run())
+
+
+def test_waiter_cancelled_after_getting_the_slot():
+    async def run():
+        queue = FairQueue(1)
+        order: List[str] = []
+        release = asyncio.Event()
+        release.set()
+        holder = queue.slot(Flow("a", 1))
+        await holder.__aenter__()
+        waiter = asyncio.create_task(hold(queue, Flow("b", 1), "cancelled", order, release))
+        await asyncio.sleep(0)
+        await holder.__aexit__(None, None, None)
+        # The slot was handed over but the waiter hasn't run yet
+        assert queue.active == 1 and not queue.waiting
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert order == []
+        assert queue.active == 0
+        # The slot is free for the next flow right away
+        await asyncio.wait_for(hold(queue, Flow("c", 1), "next", order, release), 1)
+        assert order == ["next"]
+    asyncio.run(run())
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=0.0, slept=[])
+
+    async def sleep(seconds: float) -> None:
+        now.slept.append(seconds)
+        now.value += seconds
+
+    monkeypatch.setattr(fairshare, "time", SimpleNamespace(monotonic=lambda: now.value))
+    monkeypatch.setattr(fairshare.asyncio, "sleep", sleep)
+    return now
+
+
+def test_token_bucket_debt(clock):
+    async def run():
+        bucket = TokenBucket(100, 100)
+        await bucket.consume(100)
+        assert clock.slept == []
+        # Larger than the burst, let through and paid for by waiting
+        await bucket.consume(250)
+        assert clock.slept == pytest.approx([2.5])
+        await bucket.consume(10)
+        assert clock.slept == pytest.approx([2.5, 0.1])
+        # Idle time refills at most the burst
+        clock.value += 100
+        await bucket.consume(150)
+        assert clock.slept == pytest.approx([2.5, 0.1, 0.5])
+        assert clock.value == pytest.approx(103.1)
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("remote,forwarded,expected", [
+    ("1.1.1.1", None, "1.1.1.1"),
+    # Only a trusted proxy may name the client
+    ("1.1.1.1", "2.2.2.2", "1.1.1.1"),
+    ("10.0.0.1", None, "10.0.0.1"),
+    ("10.0.0.1", "2.2.2.2", "2.2.2.2"),
+    ("10.0.0.1", "6.6.6.6, 2.2.2.2", "2.2.2.2"),
+    ("10.0.0.1", "6.6.6.6, 2.2.2.2, 10.0.0.2", "2.2.2.2"),
+    ("10.0.0.1", "10.0.0.2", "10.0.0.2"),
+])
+def test_client_ip(monkeypatch, remote, forwarded, expected):
+    monkeypatch.setattr(Config, "TRUSTED_PROXIES", ["10.0.0.1", "10.0.0.2"])
+    headers = CIMultiDict({"X-Forwarded-For": forwarded} if forwarded else {})
+    req = make_mocked_request("GET", "/1/a.mp4", headers=headers,
+                              transport=SimpleNamespace(get_extra_info=lambda *_: (remote, 1234)))
+    assert client_ip(req) == expected
@@ -0,0 +1,97 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# pylint: disable=protected-access
+
+import asyncio
+
+from typing import List, Optional
+
+import pytest
+
+from tgfs.utils import MessageBatcher
+
+
+class Shutdown(BaseException):
+    pass
+
+
+class StubClient:
+    def __init__(self, error: Optional[BaseException] = None, block: bool = False, short: bool = False) -> None:
+        self.calls: List[List[int]] = []
+        self.error = error
+        self.block = block
+        self.short = short
+
+    async def get_messages(self, _chat, ids: List[int]):
+        self.calls.append(ids)
+        if self.block:
+            await asyncio.Event().wait()
+        if self.error:
+            raise self.error
+        messages = [f"message {msg_id}" if msg_id < 100 else None for msg_id in ids]
+        # A short answer must not leave the callers of the missing ids hanging
+        return messages[:-1] if self.short else messages
+
+
+def test_batches_requests():
+    async def run():
+        client = StubClient()
+        batcher = MessageBatcher(client, 0.01)
+        results = await asyncio.gather(batcher.get(1), batcher.get(2), batcher.get(1))
+        assert results == ["message 1", "message 2", "message 1"]
+        assert client.calls == [[1, 2]]
+        assert await batcher.get(3) == "message 3"
+        assert client.calls == [[1, 2], [3]]
+    asyncio.run(run())
+
+
+def test_missing_ids_resolve_to_none():
+    async def run():
+        batcher = MessageBatcher(StubClient(), 0)
+        assert await asyncio.gather(batcher.get(100), batcher.get(5)) == [None, "message 5"]
+        batcher = MessageBatcher(StubClient(short=True), 0)
+        assert await asyncio.wait_for(asyncio.gather(batcher.get(1), batcher.get(2)), 1) == ["message 1", None]
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("error", [OSError("down"), Shutdown()])
+def test_errors_reach_every_caller(error):
+    async def run():
+        batcher = MessageBatcher(StubClient(error), 0)
+        futures = [batcher.get(1), batcher.get(2)]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        assert results == [error, error]
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("block", [False, True])
+def test_cancelled_flush_cancels_callers(block):
+    async def run():
+        client = StubClient(block=block)
+        batcher = MessageBatcher(client, 0 if block else 10)
+        futures = [batcher.get(1), batcher.get(2)]
+        task = batcher._task
+        await asyncio.sleep(0.01)
+        assert bool(client.calls) == block
+        task.cancel()
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        assert all(isinstance(result, asyncio.CancelledError) for result in results)
+        # The next request starts a new batch instead of waiting on the cancelled one
+        client.block = False
+        batcher.delay = 0
+        assert await asyncio.wait_for(batcher.get(3), 1) == "message 3"
+    asyncio.run(run())
@@ -0,0 +1,98 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from tgfs import metrics
+from tgfs.metrics import Counter, Gauge, Histogram
+
+
+def unregister(*created: metrics.Metric) -> None:
+    for metric in created:
+        metrics.registry.remove(metric)
+
+
+def test_render():
+    counter = Counter("test_requests_total", "Requests", ("result",))
+    gauge = Gauge("test_streams", "Streams")
+    histogram = Histogram("test_seconds", "Durations", buckets=(0.1, 1))
+    try:
+        counter.inc(result="hit")
+        counter.inc(2, result="hit")
+        counter.set(5, result="miss")
+        gauge.set(3)
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        assert counter.render().splitlines()[2:] == ['test_requests_total{result="hit"} 3',
+                                                     'test_requests_total{result="miss"} 5']
+        assert gauge.render().splitlines()[1:] == ["# TYPE test_streams gauge", "test_streams 3"]
+        assert histogram.render().splitlines()[2:] == [
+            'test_seconds_bucket{le="0.1"} 1', 'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3', "test_seconds_sum 5.55", "test_seconds_count 3"]
+    finally:
+        unregister(counter, gauge, histogram)
+
+
+def test_const_labels(monkeypatch):
+    counter = Counter("test_hits_total", "Hits", ("bot",))
+    histogram = Histogram("test_wait_seconds", "Waits", buckets=(1,))
+    monkeypatch.setattr(metrics, "const_labels", {"worker": "2"})
+    try:
+        counter.inc(bot=1)
+        histogram.observe(0.5)
+        assert counter.render().splitlines()[2:] == ['test_hits_total{worker="2",bot="1"} 1']
+        assert histogram.render().splitlines()[2:] == [
+            'test_wait_seconds_bucket{worker="2",le="1"} 1', 'test_wait_seconds_bucket{worker="2",le="+Inf"} 1',
+            'test_wait_seconds_sum{worker="2"} 0.5', 'test_wait_seconds_count{worker="2"} 1']
+    finally:
+        unregister(counter, histogram)
+
+
+def test_updates_from_threads():
+    counter = Counter("test_parts_total", "Parts", ("dc",))
+    histogram = Histogram("test_part_seconds", "Part durations", ("dc",))
+    stop = threading.Event()
+    errors = []
+
+    def update(thread: int) -> None:
+        for i in range(2000):
+            counter.inc(dc=f"{thread}-{i % 50}")
+            counter.set(i, dc=f"set-{thread}-{i % 50}")
+            histogram.observe(0.01, dc=f"{thread}-{i % 50}")
+
+    def render() -> None:
+        while not stop.is_set():
+            try:
+                counter.render()
+                histogram.render()
+            except RuntimeError as e:
+                errors.append(e)
+
+    try:
+        renderer = threading.Thread(target=render)
+        renderer.start()
+        threads = [threading.Thread(target=update, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        renderer.join()
+        assert errors == []
+        assert sum(value for key, value in counter.values.items() if not key[0].startswith("set")) == 8000
+        assert sum(sum(counts) for counts in histogram.counts.values()) == 8000
+    finally:
+        unregister(counter, histogram)
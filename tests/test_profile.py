@@ -0,0 +1,61 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from tgfs.config import Config
+from tgfs.routes import routes
+
+
+def get_profile(query: str) -> int:
+    async def run():
+        app = web.Application()
+        app.add_routes(routes)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            async with ClientSession() as session:
+                async with session.get(server.make_url(f"/profile?{query}")) as resp:
+                    await resp.read()
+                    return resp.status
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def profiler(monkeypatch):
+    monkeypatch.setattr(Config, "PROFILER", True)
+
+
+@pytest.mark.parametrize("query", ["seconds=nan", "seconds=inf", "seconds=-inf", "interval=nan",
+                                   "interval=inf", "seconds=0.01&interval=NaN", "seconds=soon"])
+def test_rejects_bad_numbers(query):
+    assert get_profile(query) == 400
+
+
+def test_samples():
+    assert get_profile("seconds=0.05&interval=0.01") == 200
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(Config, "PROFILER", False)
+    assert get_profile("seconds=0.05") == 404
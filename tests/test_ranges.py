@@ -0,0 +1,263 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Serves random files from the bench's fake DC and checks every byte of random ranges, along
+# with the exact parts requested from Telegram for them.
+
+import asyncio
+import itertools
+import random
+import time
+
+from typing import Optional, Set, Tuple
+
+import pytest
+
+from aiohttp import ClientError, ClientSession, web
+from aiohttp.test_utils import TestServer
+from telethon.tl.types import InputDocumentFileLocation
+
+from bench.fakes import BENCH_DC
+from tgfs.config import Config
+from tgfs.file_store import file_store
+from tgfs.paralleltransfer import MIN_PART_SIZE, ParallelTransferrer
+from tgfs.routes import routes, stream_file
+from tgfs.telegram import multi_clients
+from tgfs.utils import FileInfo
+
+PART_SIZES = [MIN_PART_SIZE << shift for shift in range(9)] + [1024 * 1024]
+CASES = 150
+
+msg_ids = itertools.count(10 ** 6)
+
+
+def make_file(dc_bytes: int, bot_id: int = 1) -> FileInfo:
+    msg_id = next(msg_ids)
+    return FileInfo(dc_bytes, "application/octet-stream", f"{msg_id}.bin", msg_id, BENCH_DC,
+                    InputDocumentFileLocation(msg_id, bot_id, b"", ""))
+
+
+def expected_parts(first: int, last: int) -> Set[Tuple[int, int]]:
+    part_size = ParallelTransferrer.choose_part_size(last - first + 1)
+    return {(part * part_size, part_size) for part in range(first // part_size, last // part_size + 1)}
+
+
+def check_fetched(fetched, first: int, last: int) -> None:
+    # Nothing outside the range, nothing twice, and only limits upload.getFile accepts
+    assert sorted(fetched) == sorted(expected_parts(first, last))
+    for offset, limit in fetched:
+        assert (1024 * 1024) % limit == 0 and offset % limit == 0
+
+
+def random_setup(rng: random.Random, monkeypatch) -> int:
+    part_size = rng.choice(PART_SIZES)
+    monkeypatch.setattr(Config, "DOWNLOAD_PART_SIZE", part_size)
+    monkeypatch.setattr(Config, "DOWNLOAD_WINDOW", rng.randint(1, 8))
+    # Files around a few parts long, landing on part boundaries now and then
+    size = rng.choice([rng.randint(1, 4 * part_size), part_size * rng.randint(1, 4)])
+    return size + rng.choice([0, 0, -1, 1]) if size > 1 else size
+
+
+def test_download(make_dc, make_transferrer, monkeypatch):
+    async def run():
+        rng = random.Random(14)
+        for _ in range(CASES):
+            size = random_setup(rng, monkeypatch)
+            dc = make_dc(rng.randbytes(size))
+            transfer = make_transferrer(dc)
+            file = make_file(size)
+            first = rng.choice([0, rng.randrange(size), size - 1])
+            last = rng.choice([first, rng.randrange(first, size), size - 1])
+            received = b"".join([bytes(chunk) async for chunk in transfer.download(file, first, last)])
+            assert received == dc.data[first:last + 1], (size, first, last, Config.DOWNLOAD_PART_SIZE)
+            check_fetched(dc.fetched, first, last)
+            assert transfer.users == 0
+            await transfer.close_connection()
+    asyncio.run(run())
+
+
+def test_part_boundaries(make_dc, make_transferrer, monkeypatch):
+    async def run():
+        monkeypatch.setattr(Config, "DOWNLOAD_PART_SIZE", 16384)
+        size = 3 * 16384
+        for first, last in [(0, 0), (0, 16383), (16383, 16384), (16384, 32767), (16384, 16384),
+                            (32767, 32768), (0, size - 1), (size - 1, size - 1), (100, 4195)]:
+            dc = make_dc(random.Random(first ^ last).randbytes(size))
+            transfer = make_transferrer(dc)
+            received = b"".join([bytes(chunk) async for chunk in transfer.download(make_file(size), first, last)])
+            assert received == dc.data[first:last + 1], (first, last)
+            check_fetched(dc.fetched, first, last)
+            await transfer.close_connection()
+    asyncio.run(run())
+
+
+def reference(size: int, header: Optional[str]) -> Tuple[int, int, int]:
+    # What the response to a Range header should be: status, first and last byte
+    if header is None:
+        return 200, 0, size - 1
+    start, end = header[len("bytes="):].split("-")
+    if not start:
+        first, last = max(0, size - int(end)), size - 1
+    else:
+        first, last = int(start), min(size - 1, int(end)) if end else size - 1
+    if first >= size:
+        return 416, 0, 0
+    return 200 if first == 0 and last == size - 1 else 206, first, last
+
+
+def random_header(rng: random.Random, size: int) -> Optional[str]:
+    first = rng.randrange(size)
+    kind = rng.randrange(6)
+    if kind == 0:
+        return None
+    if kind == 1:
+        return f"bytes={first}-{rng.randrange(first, size)}"
+    if kind == 2:
+        return f"bytes={first}-"
+    if kind == 3:
+        return f"bytes=-{rng.randint(1, size + 10)}"
+    if kind == 4:
+        # Ending past EOF is served until the end of the file
+        return f"bytes={first}-{size + rng.randint(0, 10 ** 6)}"
+    return f"bytes={size + rng.randint(0, 10)}-{rng.choice(['', str(size + 20)])}"
+
+
+def test_http(make_dc, make_transferrer, monkeypatch):
+    async def run():
+        rng = random.Random(416)
+        app = web.Application()
+        app.add_routes(routes)
+        server = TestServer(app)
+        await server.start_server()
+        multi_clients.clear()
+        try:
+            async with ClientSession() as session:
+                for _ in range(CASES):
+                    size = random_setup(rng, monkeypatch)
+                    dc = make_dc(rng.randbytes(size))
+                    transfer = multi_clients[1] = make_transferrer(dc)
+                    file = make_file(size)
+                    await file_store.put(file.id, 1, file)
+                    header = random_header(rng, size)
+                    status, first, last = reference(size, header)
+                    async with session.get(server.make_url(f"/{file.id}/{file.file_name}"),
+                                           headers={"Range": header} if header else {}) as resp:
+                        body = await resp.read()
+                    assert resp.status == status, (size, header)
+                    if status == 416:
+                        assert resp.headers["Content-Range"] == f"bytes */{size}"
+                        assert dc.fetched == []
+                    else:
+                        assert resp.headers["Content-Range"] == f"bytes {first}-{last}/{size}"
+                        assert body == dc.data[first:last + 1], (size, header, Config.DOWNLOAD_PART_SIZE)
+                        check_fetched(dc.fetched, first, last)
+                    assert transfer.active_clients == 0
+                    await transfer.close_connection()
+        finally:
+            multi_clients.clear()
+            await server.close()
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("header", ["bytes=5-2", "bytes=1-2-3", "items=0-1"])
+def test_http_rejects_malformed_ranges(make_dc, make_transferrer, header):
+    async def run():
+        size = 1000
+        dc = make_dc(random.Random(0).randbytes(size))
+        multi_clients.clear()
+        transfer = multi_clients[1] = make_transferrer(dc)
+        file = make_file(size)
+        await file_store.put(file.id, 1, file)
+        app = web.Application()
+        app.add_routes(routes)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            async with ClientSession() as session:
+                async with session.get(server.make_url(f"/{file.id}/{file.file_name}"),
+                                       headers={"Range": header}) as resp:
+                    assert resp.status == 416
+                    assert resp.headers["Content-Range"] == f"bytes */{size}"
+        finally:
+            multi_clients.clear()
+            await server.close()
+        assert dc.fetched == []
+        assert transfer.active_clients == 0
+    asyncio.run(run())
+
+
+def test_http_releases_client_when_prepare_fails(make_dc, make_transferrer, monkeypatch):
+    async def prepare(self, request):
+        raise ConnectionResetError("client went away")
+
+    async def run():
+        size = 1000
+        dc = make_dc(random.Random(0).randbytes(size))
+        multi_clients.clear()
+        transfer = multi_clients[1] = make_transferrer(dc)
+        file = make_file(size)
+        await file_store.put(file.id, 1, file)
+        app = web.Application()
+        app.add_routes(routes)
+        server = TestServer(app)
+        await server.start_server()
+        monkeypatch.setattr(web.StreamResponse, "prepare", prepare)
+        try:
+            async with ClientSession() as session:
+                # The server drops the connection, there are no headers to answer with
+                with pytest.raises(ClientError):
+                    await session.get(server.make_url(f"/{file.id}/{file.file_name}"))
+        finally:
+            monkeypatch.undo()
+            multi_clients.clear()
+            await server.close()
+        assert transfer.active_clients == 0
+    asyncio.run(run())
+
+
+def test_stream_hands_client_back_after_migrating(make_dc, make_transferrer):
+    async def run():
+        size = 3 * MIN_PART_SIZE
+        dc = make_dc(random.Random(1).randbytes(size))
+        multi_clients.clear()
+        first = multi_clients[1] = make_transferrer(dc, 1)
+        second = multi_clients[2] = make_transferrer(dc, 2)
+        file = make_file(size)
+        await file_store.put(file.id, 1, file)
+        await file_store.put(file.id, 2, FileInfo(size, file.mime_type, file.file_name, file.id, BENCH_DC,
+                                                  InputDocumentFileLocation(file.id, 2, b"", "")))
+
+        async def failing(*args):
+            first.flood_wait_until = time.monotonic() + 30
+            raise ConnectionError("DC went away")
+            yield  # pylint: disable=unreachable
+
+        first.download = failing
+        first.active_clients += 1
+        chunks = []
+        try:
+            async for chunk in stream_file(first, file.id, file, 0, size - 1, time.monotonic(), None):
+                chunks.append(bytes(chunk))
+                # The stream counts against the bot that is serving it
+                assert (first.active_clients, second.active_clients) == (0, 1)
+        finally:
+            multi_clients.clear()
+        assert b"".join(chunks) == dc.data
+        assert (first.active_clients, second.active_clients) == (1, 0)
+        first.active_clients -= 1
+        await first.close_connection()
+        await second.close_connection()
+    asyncio.run(run())
@@ -0,0 +1,64 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from typing import List
+
+from tgfs.readahead import INITIAL_WINDOW, ReadAhead
+
+
+def test_first_parts_are_requested_together():
+    async def run():
+        requested: List[int] = []
+        gate = asyncio.Event()
+
+        async def fetch(part: int) -> bytes:
+            requested.append(part)
+            await gate.wait()
+            return bytes([part])
+
+        readahead = ReadAhead(fetch, 0, 99, 8)
+        first = asyncio.create_task(readahead.next())
+        for _ in range(2):
+            await asyncio.sleep(0)
+        # The first part is still on its way, the next ones are already requested
+        assert requested == list(range(INITIAL_WINDOW + 1))
+        gate.set()
+        assert await first == b"\x00"
+        readahead.close()
+    asyncio.run(run())
+
+
+def test_window_bounds():
+    async def run():
+        async def fetch(part: int) -> bytes:
+            await asyncio.sleep(0)
+            return bytes([part])
+
+        small = ReadAhead(fetch, 0, 9, 2)
+        assert small.window == 2
+        assert [await small.next() for _ in range(10)] == [bytes([part]) for part in range(10)]
+        assert small.window <= 2
+
+        # A reader that keeps finding its parts ready shrinks the window
+        slow = ReadAhead(fetch, 0, 99, 8)
+        for _ in range(INITIAL_WINDOW + 2):
+            await slow.next()
+            await asyncio.sleep(0.01)
+        assert slow.window < INITIAL_WINDOW
+        slow.close()
+    asyncio.run(run())
@@ -0,0 +1,49 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+
+import pytest
+
+from tgfs.routes import select_client
+from tgfs.telegram import multi_clients
+
+
+@pytest.fixture
+def bots(make_dc, make_transferrer):
+    dc = make_dc(b"")
+    multi_clients.clear()
+    for bot_id in range(1, 5):
+        multi_clients[bot_id] = make_transferrer(dc, bot_id)
+    yield multi_clients
+    multi_clients.clear()
+
+
+@pytest.mark.parametrize("dc_id", [None, 2])
+def test_concurrent_streams_spread_across_cold_bots(bots, dc_id):
+    # None of the bots has fetched a part yet, every selection still counts towards the next one
+    chosen = Counter()
+    for _ in range(20):
+        client_id = select_client(dc_id)
+        bots[client_id].active_clients += 1
+        chosen[client_id] += 1
+    assert chosen == {1: 5, 2: 5, 3: 5, 4: 5}
+
+
+def test_busy_warm_bot_loses_to_idle_cold_bot(bots):
+    bots[1].part_latency = 0.05
+    bots[1].active_clients = 30
+    assert select_client(2) != 1
@@ -5,7 +5,7 @@ from flask import Flask, request, send_file, Response, redirect, render_template
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
 from telegram.ext import Dispatcher, MessageHandler, Filters, CallbackQueryHandler, CommandHandler
 from telegram.utils.request import Request
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import qrcode
 from io import BytesIO
 import requests
@@ -13,6 +13,13 @@ from pymongo import MongoClient
 import urllib.parse
 import traceback
 import urllib3
+import threading
+import time
+import base64
+import hashlib
+import hmac
+import struct
+from collections import OrderedDict
 
 # ======== إعداد Flask ========
 app = Flask(__name__)
@@ -23,8 +30,20 @@ BIN_CHANNEL = os.getenv("BIN_CHANNEL")
 PUBLIC_URL = os.getenv("PUBLIC_URL")
 ADMIN_ID = "7485195087"
 MONGO_URI = os.getenv("MONGO_URI")
-
-bot = Bot(token=BOT_TOKEN)
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 256 * 1024))
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", 3600))
+SETTINGS_CACHE_TTL = int(os.getenv("SETTINGS_CACHE_TTL", 60))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 300))
+# مفتاح توقيع الروابط، يُشتق من توكن البوت إن لم يُحدَّد
+LINK_SECRET = (os.getenv("LINK_SECRET") or hashlib.sha256(f"links:{BOT_TOKEN}".encode()).hexdigest()).encode()
+# مسار الملف الذي يعيده getFile صالح لساعة تقريباً
+FILE_PATH_TTL = 55 * 60
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+# يرسله Vercel في ترويسة Authorization مع طلبات cron
+CRON_SECRET = os.getenv("CRON_SECRET")
+
+# مجمّع اتصالات لطلبات Bot API حتى لا تنتظر الطلبات المتزامنة اتصالاً واحداً
+bot = Bot(token=BOT_TOKEN, request=Request(con_pool_size=HTTP_POOL_SIZE))
 dispatcher = Dispatcher(bot, None, workers=0, use_context=True)
 
 # ======== الاتصال بقاعدة البيانات ========
@@ -50,6 +69,142 @@ except Exception as e:
     print(f"❌ فشل الاتصال بقاعدة البيانات: {e}")
     mongo_client_active = False
 
+# ======== جلسة HTTP مشتركة مع خادم ملفات تيليجرام ========
+# الاتصالات تبقى مفتوحة (keep-alive) فلا يتكرر اتصال TLS مع كل طلب Range
+http_session = requests.Session()
+http_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+http_session.mount("https://", http_adapter)
+http_session.mount("http://", http_adapter)
+
+PROXY_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "Last-Modified", "ETag")
+
+def proxy_telegram_file(file_id, headers=None):
+    upstream_headers = {}
+    range_header = request.headers.get('Range')
+    if range_header:
+        upstream_headers["Range"] = range_header
+    r = http_session.get(get_file_path(file_id), headers=upstream_headers, stream=True, timeout=(10, 60))
+    if r.status_code == 404:
+        # انتهت صلاحية المسار المحفوظ قبل موعده، نطلب مساراً جديداً مرة واحدة
+        r.close()
+        file_path_cache.delete(file_id)
+        r = http_session.get(get_file_path(file_id), headers=upstream_headers, stream=True, timeout=(10, 60))
+
+    def generate():
+        # يُغلق الاتصال مع تيليجرام عند انتهاء الملف أو عند انقطاع العميل
+        try:
+            for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            r.close()
+
+    response_headers = {key: r.headers[key] for key in PROXY_HEADERS if key in r.headers}
+    response_headers.setdefault("Accept-Ranges", "bytes")
+    if headers:
+        response_headers.update(headers)
+    return Response(generate(), status=r.status_code, headers=response_headers, direct_passthrough=True)
+
+# ======== ذاكرة مؤقتة داخل العملية ========
+class TTLCache:
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if time.monotonic() > expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            elif len(self.entries) >= self.maxsize:
+                # حذف العنصر الأقل استخداماً مؤخراً
+                self.entries.popitem(last=False)
+            self.entries[key] = (value, time.monotonic() + ttl)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+link_cache = TTLCache()
+file_path_cache = TTLCache()
+settings_cache = TTLCache()
+user_cache = TTLCache()
+
+def cache_link(link_doc):
+    # لا يبقى الرابط في الذاكرة بعد انتهاء صلاحيته
+    ttl = min(LINK_CACHE_TTL, (link_doc["expire_time"] - datetime.now()).total_seconds())
+    link_cache.set(link_doc["_id"], link_doc, ttl)
+
+def get_link(file_unique_id):
+    link_doc = link_cache.get(file_unique_id)
+    if link_doc is None:
+        link_doc = links_collection.find_one({"_id": file_unique_id})
+        if link_doc:
+            cache_link(link_doc)
+    return link_doc
+
+# ======== الروابط الموقعة ========
+# بنفس صيغة tgfs/links.py: الرابط /get_file/{token}/{file_name} والرمز payload.signature بترميز base64 للروابط،
+# والتوقيع أول 12 بايت من HMAC-SHA256 على payload واسم الملف. هنا payload هو موعد الانتهاء (4 بايت) يليه
+# file_id بدل رقم الرسالة، فكل ما يلزم التحميل في الرابط نفسه ولا تُقرأ قاعدة البيانات
+SIGNATURE_SIZE = 12
+
+def b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def link_signature(payload, file_name):
+    return hmac.new(LINK_SECRET, payload + file_name.encode(), hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+def sign_link(file_id, file_name, expire_time):
+    payload = struct.pack(">I", int(expire_time.timestamp())) + file_id.encode()
+    return f"{b64encode(payload)}.{b64encode(link_signature(payload, file_name))}/{urllib.parse.quote(file_name)}"
+
+def verify_link(token, file_name):
+    payload, _, signature = token.partition(".")
+    try:
+        payload = b64decode(payload)
+        # تُقارن البايتات، فالنص غير ASCII في الرابط يُرفض بدل أن يرفع TypeError
+        if not hmac.compare_digest(b64decode(signature), link_signature(payload, file_name)):
+            return None
+        expires, = struct.unpack(">I", payload[:4])
+        file_id = payload[4:].decode("ascii")
+    except (ValueError, struct.error):
+        return None
+    return {"_id": token, "file_id": file_id, "file_name": file_name, "expire_time": datetime.fromtimestamp(expires)}
+
+def resolve_link(link_id, file_name=None):
+    # الروابط القديمة (file_unique_id بدون اسم ملف) ما زالت تُقرأ من قاعدة البيانات
+    if file_name is None:
+        return get_link(link_id)
+    return verify_link(link_id, file_name)
+
+def get_file_path(file_id):
+    file_path = file_path_cache.get(file_id)
+    if file_path is None:
+        file_path = bot.get_file(file_id).file_path
+        file_path_cache.set(file_id, file_path, FILE_PATH_TTL)
+    return file_path
+
 # ======== دوال الترجمة ========
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LANG_DIR = os.path.join(BASE_DIR, 'lang')
@@ -70,8 +225,8 @@ def get_user_lang(user_id, tg_lang_code):
     if not mongo_client_active:
         return tg_lang_code
         
-    user_doc = users_collection.find_one({"user_id": user_id})
-    if user_doc and 'preferred_lang' in user_doc:
+    user_doc = get_user(user_id)
+    if 'preferred_lang' in user_doc:
         return user_doc['preferred_lang']
     
     return tg_lang_code
@@ -85,15 +240,41 @@ def get_string(user_lang, key, **kwargs):
     return text.format(**kwargs)
 
 # ======== دوال MongoDB المساعدة ========
+# الإعدادات وسجلات المستخدمين تُقرأ من الذاكرة، وكل تعديل يُكتب في القاعدة وفي الذاكرة معاً
+def get_settings():
+    settings = settings_cache.get("global_settings")
+    if settings is None:
+        settings = settings_collection.find_one({"_id": "global_settings"}) or {}
+        settings_cache.set("global_settings", settings, SETTINGS_CACHE_TTL)
+    return settings
+
 def get_setting(key):
     if mongo_client_active:
-        settings = settings_collection.find_one({"_id": "global_settings"})
-        return settings.get(key)
+        return get_settings().get(key)
     return False
 
 def update_setting(key, value):
     if mongo_client_active:
         settings_collection.update_one({"_id": "global_settings"}, {"$set": {key: value}})
+        settings = settings_cache.get("global_settings")
+        if settings is not None:
+            settings_cache.set("global_settings", {**settings, key: value}, SETTINGS_CACHE_TTL)
+
+def get_user(user_id):
+    if not mongo_client_active:
+        return {}
+    user_doc = user_cache.get(user_id)
+    if user_doc is None:
+        # قاموس فارغ يعني أن المستخدم غير مسجل
+        user_doc = users_collection.find_one({"user_id": user_id}) or {}
+        user_cache.set(user_id, user_doc, USER_CACHE_TTL)
+    return user_doc
+
+def update_user(user_id, fields, upsert=False):
+    result = users_collection.update_one({"user_id": user_id}, {"$set": fields}, upsert=upsert)
+    user_doc = user_cache.get(user_id)
+    if user_doc is not None and (user_doc or result.upserted_id is not None):
+        user_cache.set(user_id, {**user_doc, "user_id": user_id, **fields}, USER_CACHE_TTL)
 
 def get_allowed_users():
     if mongo_client_active:
@@ -104,20 +285,20 @@ def is_allowed_user(user_id):
     if not mongo_client_active: return False
     if get_setting("public_mode"):
         return True
-    return users_collection.count_documents({"user_id": user_id, "is_allowed": True}) > 0
+    return bool(get_user(user_id).get("is_allowed"))
 
 def add_user(user_id):
     if mongo_client_active:
-        user_doc = users_collection.find_one({"user_id": user_id})
-        if user_doc and user_doc.get("is_allowed"):
+        user_doc = get_user(user_id)
+        if user_doc.get("is_allowed"):
             return False
-        users_collection.update_one({"user_id": user_id}, {"$set": {"is_allowed": True}}, upsert=True)
+        update_user(user_id, {"is_allowed": True}, upsert=True)
         return True
     return False
 
 def remove_user(user_id):
     if mongo_client_active:
-        users_collection.update_one({"user_id": user_id}, {"$set": {"is_allowed": False}})
+        update_user(user_id, {"is_allowed": False})
         return True
     return False
 
@@ -240,7 +421,7 @@ def handle_file(update, context):
         return
 
     try:
-        if not users_collection.find_one({"user_id": user.id}):
+        if not get_user(user.id):
             add_user(user.id)
             new_user_alert = get_string('ar', 'new_user_alert', user_id=user.id, user_name=user.first_name)
             send_alert(new_user_alert)
@@ -262,16 +443,19 @@ def handle_file(update, context):
 
         expire_time = datetime.now() + timedelta(hours=24)
         
-        links_collection.insert_one({
+        link_doc = {
             "_id": file_unique_id, 
             "file_id": file_id_to_store,
             "expire_time": expire_time,
+            # نسخة UTC من موعد الانتهاء لفهرس TTL
+            "expire_at": datetime.now(timezone.utc) + timedelta(hours=24),
             "file_name": file_name,
             "file_size": file_info.file_size,
             "thumb_id": thumb_id
-        })
+        }
+        links_collection.insert_one(link_doc)
 
-        file_url = f"{PUBLIC_URL}/get_file/{file_unique_id}"
+        file_url = f"{PUBLIC_URL}/get_file/{sign_link(file_id_to_store, file_name, expire_time)}"
         qr_image = generate_qr(file_url)
         
         caption_text = get_string(user_lang, 'link_caption')
@@ -316,7 +500,7 @@ def button_handler(update, context):
     if query.data.startswith("set_lang_"):
         new_lang_code = query.data.split("_")[2]
         if mongo_client_active:
-            users_collection.update_one({"user_id": user_id}, {"$set": {"preferred_lang": new_lang_code}}, upsert=True)
+            update_user(user_id, {"preferred_lang": new_lang_code}, upsert=True)
             new_lang_name = SUPPORTED_LANGUAGES.get(new_lang_code, 'Unknown')
             query.edit_message_text(f"✅ تم تغيير لغة البوت إلى {new_lang_name}.")
         else:
@@ -392,11 +576,13 @@ def handle_text(update, context):
 
 # ======== مسار صفحة الملفات ========
 @app.route("/get_file/<file_unique_id>", methods=["GET"])
-def get_file(file_unique_id):
+@app.route("/get_file/<file_unique_id>/<path:file_name>", methods=["GET"])
+def get_file(file_unique_id, file_name=None):
     try:
         print(f"Received request for file unique ID: {file_unique_id}")
         
-        link_doc = links_collection.find_one({"_id": file_unique_id})
+        signed = file_name is not None
+        link_doc = resolve_link(file_unique_id, file_name)
         
         if not link_doc:
             print(f"File unique ID {file_unique_id} not found in database.")
@@ -407,7 +593,9 @@ def get_file(file_unique_id):
         file_id = link_doc["file_id"]
         
         if datetime.now() > expire_time:
-            links_collection.delete_one({"_id": file_unique_id})
+            if not signed:
+                links_collection.delete_one({"_id": file_unique_id})
+                link_cache.delete(file_unique_id)
             print(f"Link for file unique ID {file_unique_id} has expired.")
             return get_string('ar', 'link_expired'), 400
 
@@ -429,6 +617,10 @@ def get_file(file_unique_id):
         elif is_document:
             file_type = "document"
 
+        stream_url = f"/stream_file/{file_unique_id}"
+        if signed:
+            stream_url += f"/{urllib.parse.quote(file_name)}"
+
         mime_type = "video/mp4" if is_video else "audio/mpeg" if is_audio else "image/jpeg" if is_image else "application/octet-stream"
         
         return render_template_string("""
@@ -515,17 +707,17 @@ def get_file(file_unique_id):
 
     {% if file_type == "video" or file_type == "audio" %}
     <video id="player" controls crossorigin playsinline>
-        <source src="/stream_file/{{ file_unique_id }}" type="{{ mime_type }}">
+        <source src="{{ stream_url }}" type="{{ mime_type }}">
     </video>
     {% elif file_type == "image" %}
-    <img src="/stream_file/{{ file_unique_id }}" alt="Image">
+    <img src="{{ stream_url }}" alt="Image">
     {% elif file_type == "document" %}
-    <iframe src="/stream_file/{{ file_unique_id }}" style="height:500px;"></iframe>
+    <iframe src="{{ stream_url }}" style="height:500px;"></iframe>
     {% else %}
-    <p>معاينة الملف غير مدعومة. <a href="/stream_file/{{ file_unique_id }}" class="download-link">تحميل هنا</a></p>
+    <p>معاينة الملف غير مدعومة. <a href="{{ stream_url }}" class="download-link">تحميل هنا</a></p>
     {% endif %}
 
-    <a href="/stream_file/{{ file_unique_id }}?download=true" class="download-link">⬇️ تحميل الملف</a>
+    <a href="{{ stream_url }}?download=true" class="download-link">⬇️ تحميل الملف</a>
 </div>
 
 <script src="https://cdn.plyr.io/3.7.8/plyr.polyfilled.js"></script>
@@ -537,7 +729,7 @@ def get_file(file_unique_id):
 
 </body>
 </html>
-""", file_name=file_name, file_unique_id=file_unique_id, mime_type=mime_type, file_type=file_type)
+""", file_name=file_name, stream_url=stream_url, mime_type=mime_type, file_type=file_type)
 
 
     except Exception as e:
@@ -546,43 +738,30 @@ def get_file(file_unique_id):
 
 # ======== مسار تشغيل الفيديو/التحميل (الخادم الوسيط) ========
 @app.route("/stream_file/<file_unique_id>", methods=["GET"])
-def stream_file(file_unique_id):
+@app.route("/stream_file/<file_unique_id>/<path:file_name>", methods=["GET"])
+def stream_file(file_unique_id, file_name=None):
     try:
         print(f"Received stream request for file unique ID: {file_unique_id}")
-        link_doc = links_collection.find_one({"_id": file_unique_id})
+        link_doc = resolve_link(file_unique_id, file_name)
         
         if not link_doc or datetime.now() > link_doc["expire_time"]:
             print(f"Stream link for file unique ID {file_unique_id} is invalid or expired.")
             return get_string('ar', 'link_invalid'), 400
             
         file_id = link_doc["file_id"]
-        file_info = bot.get_file(file_id)
-        telegram_file_url = file_info.file_path
         
         is_download_request = request.args.get('download', 'false').lower() == 'true'
         file_name = link_doc.get("file_name", "file")
         
         if is_download_request:
-            headers = {
+            return proxy_telegram_file(file_id, {
                 'Content-Disposition': f'attachment; filename="{file_name}"',
                 'Content-Type': 'application/octet-stream'
-            }
-            r = requests.get(telegram_file_url, stream=True)
-            return Response(r.iter_content(chunk_size=8192), headers=headers, status=r.status_code)
-
-        range_header = request.headers.get('Range', None)
-        if range_header:
-            r = requests.get(telegram_file_url, headers={"Range": range_header}, stream=True)
-            response = Response(r.iter_content(chunk_size=8192), status=r.status_code)
-            response.headers.update(r.headers)
-            return response
-        else:
-            def generate_stream():
-                with requests.get(telegram_file_url, stream=True) as r:
-                    r.raise_for_status()
-                    for chunk in r.iter_content(chunk_size=8192):
-                        yield chunk
-            return Response(generate_stream(), mimetype='video/mp4')
+            })
+
+        if request.headers.get('Range'):
+            return proxy_telegram_file(file_id)
+        return proxy_telegram_file(file_id, {'Content-Type': 'video/mp4'})
             
     except Exception as e:
         print(f"An error occurred in stream_file: {traceback.format_exc()}")
@@ -595,11 +774,7 @@ def get_thumbnail(thumb_id):
         if not thumb_id:
             return get_string('ar', 'no_thumbnail'), 404
         
-        file_info = bot.get_file(thumb_id)
-        telegram_file_url = file_info.file_path
-        
-        response = requests.get(telegram_file_url, stream=True)
-        return Response(response.iter_content(chunk_size=8192), content_type=response.headers['Content-Type'])
+        return proxy_telegram_file(thumb_id)
     except Exception as e:
         return get_string('ar', 'upload_failed', error=e), 400
 
@@ -610,31 +785,49 @@ def cleanup_expired_links():
         return
     
     current_time = datetime.now()
-    result = links_collection.delete_many({"expire_time": {"$lt": current_time}})
+    expired_ids = [doc["_id"] for doc in links_collection.find({"expire_time": {"$lt": current_time}}, {"_id": 1})]
+    result = links_collection.delete_many({"_id": {"$in": expired_ids}})
     if result.deleted_count > 0:
+        for link_id in expired_ids:
+            link_cache.delete(link_id)
         print(f"✅ تم حذف {result.deleted_count} رابط منتهي الصلاحية.")
         log_activity(f"تم حذف {result.deleted_count} رابط منتهي الصلاحية.")
         send_alert(get_string('ar', 'cleanup_success', count=result.deleted_count), file_url=None)
     else:
         print("ℹ️ لا توجد روابط منتهية الصلاحية ليتم حذفها.")
 
-# ======== وظيفة التحقق والتشغيل ========
-def check_and_run_cleanup():
-    if not mongo_client_active:
-        return
-        
-    settings = settings_collection.find_one({"_id": "global_settings"})
-    last_cleanup = settings.get("last_cleanup", datetime.now() - timedelta(hours=2))
-    
-    if datetime.now() - last_cleanup > timedelta(hours=1):
+# ======== الحذف المجدول ========
+# يستدعيه cron في Vercel (vercel.json) مرة واحدة لكل موعد بدل مجدول يعمل في كل نسخة من التطبيق،
+# ويحذف Mongo الروابط المنتهية بنفسه عبر فهرس TTL
+@app.route("/cron/cleanup", methods=["GET"])
+def scheduled_cleanup():
+    if CRON_SECRET and request.headers.get("Authorization") != f"Bearer {CRON_SECRET}":
+        return "Unauthorized", 401
+    try:
         cleanup_expired_links()
         update_setting("last_cleanup", datetime.now())
+    except Exception:
+        print(f"❌ فشل الحذف المجدول: {traceback.format_exc()}")
+        return "Cleanup failed", 500
+    return "OK", 200
+
+if mongo_client_active:
+    try:
+        # Mongo تعامل التواريخ كـ UTC، و expire_time بالتوقيت المحلي فيُحذف الرابط في غير موعده
+        if "expire_time_1" in links_collection.index_information():
+            links_collection.drop_index("expire_time_1")
+        links_collection.create_index("expire_at", expireAfterSeconds=0)
+        # الروابط المحفوظة قبل إضافة expire_at تأخذ نسخة UTC من expire_time
+        utc_offset_ms = int(datetime.now().astimezone().utcoffset().total_seconds() * 1000)
+        links_collection.update_many({"expire_at": {"$exists": False}},
+                                     [{"$set": {"expire_at": {"$subtract": ["$expire_time", utc_offset_ms]}}}])
+    except Exception as e:
+        print(f"❌ فشل إنشاء فهرس TTL للروابط: {e}")
 
 # ======== Webhook ========
 @app.route("/", methods=["POST"])
 def webhook():
     if request.method == "POST":
-        check_and_run_cleanup()
         update = Update.de_json(request.get_json(force=True), bot)
         dispatcher.process_update(update)
     return "OK", 200
@@ -642,7 +835,6 @@ def webhook():
 # ======== اختبار Flask ========
 @app.route("/test", methods=["GET"])
 def test():
-    check_and_run_cleanup()
     return "Flask يعمل على Vercel ✅", 200
 
 # ======== اختبار الإشعارات ========
@@ -689,4 +881,4 @@ dispatcher.add_handler(CommandHandler("stats", show_stats))
 # ======== تشغيل التطبيق ========
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 3000))
-    app.run(host="0.0.0.0", port=port)
+    app.run(host="0.0.0.0", port=port, threaded=True)
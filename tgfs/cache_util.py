@@ -16,60 +16,122 @@
 
 import asyncio
 import logging
+import time
 
 from collections import OrderedDict
-from typing import Optional, Callable, Awaitable, Any
+from dataclasses import dataclass
+from typing import Optional, Callable, Awaitable, Any, Dict, Hashable
 
 log = logging.getLogger(__name__)
 
+@dataclass
+class CacheEntry:
+    task: asyncio.Task
+    expires: Optional[float] = None
+    size: int = 0
+
 class AsyncLRUCache:
-    def __init__(self, fn: Callable[..., Awaitable[Any]], maxsize: Optional[int], use_first_arg: bool) -> None:
+    def __init__(self, fn: Callable[..., Awaitable[Any]], maxsize: Optional[int], use_first_arg: bool,
+                 ttl: Optional[float] = None, negative_ttl: Optional[float] = None,
+                 maxbytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None) -> None:
         self.fn = fn
         self.maxsize = maxsize
         self.use_first_arg = use_first_arg
-        self.cache: OrderedDict[int, asyncio.Task] = OrderedDict()
-
-    def _make_key(self, args, kwargs) -> int:
+        self.ttl = ttl
+        # None results are only kept for negative_ttl seconds, or not at all if it is unset
+        self.negative_ttl = negative_ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.cache: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _make_key(self, args, kwargs) -> Hashable:
         if self.use_first_arg:
             if not args:
                 raise ValueError("First argument missing for use_first_arg=True")
-            return hash(args[0])
+            return args[0]
+        if kwargs:
+            return (args, tuple(sorted(kwargs.items())))
+        return args
+
+    def _remove(self, key: Hashable, entry: CacheEntry) -> None:
+        if self.cache.get(key) is entry:
+            del self.cache[key]
+            self.currbytes -= entry.size
+
+    def _evict(self) -> None:
+        while self.cache and ((self.maxsize is not None and len(self.cache) > self.maxsize)
+                              or (self.maxbytes is not None and self.currbytes > self.maxbytes)):
+            _, entry = self.cache.popitem(last=False)
+            self.currbytes -= entry.size
+            self.evictions += 1
+
+    def _on_done(self, key: Hashable, entry: CacheEntry, task: asyncio.Task) -> None:
+        if self.cache.get(key) is not entry:
+            return
+        if task.cancelled() or task.exception() is not None:
+            self._remove(key, entry)
+            return
+        result = task.result()
+        if result is None:
+            if not self.negative_ttl:
+                self._remove(key, entry)
+                return
+            entry.expires = time.monotonic() + self.negative_ttl
         else:
-            key_data = args
-            if kwargs:
-                key_data += tuple(sorted(kwargs.items()))
-            return hash(key_data)
+            if self.ttl:
+                entry.expires = time.monotonic() + self.ttl
+            if self.sizeof is not None:
+                entry.size = self.sizeof(result)
+                self.currbytes += entry.size
+        self._evict()
 
     async def __call__(self, *args, **kwargs) -> Any:
         key = self._make_key(args, kwargs)
 
-        if key in self.cache:
-            task = self.cache[key]
+        entry = self.cache.get(key)
+        if entry is not None and entry.expires is not None and entry.expires <= time.monotonic():
+            self._remove(key, entry)
+            entry = None
+        if entry is not None:
+            self.hits += 1
             self.cache.move_to_end(key)
-            return await asyncio.shield(task)
-
-        async def call() -> Any:
-            try:
-                return await self.fn(*args, **kwargs)
-            except Exception:
-                self.cache.pop(key, None)
-                raise
+            return await asyncio.shield(entry.task)
 
-        task = asyncio.create_task(call())
-        self.cache[key] = task
+        self.misses += 1
+        entry = CacheEntry(asyncio.create_task(self.fn(*args, **kwargs)))
+        entry.task.add_done_callback(lambda task: self._on_done(key, entry, task))
+        self.cache[key] = entry
+        self._evict()
+        return await asyncio.shield(entry.task)
 
-        if self.maxsize is not None and len(self.cache) > self.maxsize:
-            self.cache.popitem(last=False)
-
-        result = await asyncio.shield(task)
-        if result is None:
-            self.cache.pop(key, None)
-        return result
+    def invalidate(self, *args, **kwargs) -> None:
+        key = self._make_key(args, kwargs)
+        entry = self.cache.get(key)
+        if entry is not None:
+            self._remove(key, entry)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.cache),
+            "bytes": self.currbytes,
+        }
 
     def cache_clear(self) -> None:
         self.cache.clear()
+        self.currbytes = 0
 
-def lru_cache(maxsize: Optional[int] = 128, use_first_arg: bool = False) -> Callable[[Callable[..., Awaitable[Any]]], AsyncLRUCache]:
+def lru_cache(maxsize: Optional[int] = 128, use_first_arg: bool = False, ttl: Optional[float] = None,
+              negative_ttl: Optional[float] = None, maxbytes: Optional[int] = None,
+              sizeof: Optional[Callable[[Any], int]] = None
+              ) -> Callable[[Callable[..., Awaitable[Any]]], AsyncLRUCache]:
     def decorator(fn: Callable[..., Awaitable[Any]]) -> AsyncLRUCache:
-        return AsyncLRUCache(fn, maxsize, use_first_arg)
+        return AsyncLRUCache(fn, maxsize, use_first_arg, ttl, negative_ttl, maxbytes, sizeof)
     return decorator
@@ -0,0 +1,145 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import os
+import tempfile
+
+from collections import OrderedDict
+from pathlib import Path
+from stat import S_ISREG
+from typing import List, Optional, Tuple
+
+from tgfs.config import Config
+
+log = logging.getLogger(__name__)
+
+# (document id, part size, part index)
+ChunkKey = Tuple[int, int, int]
+# Parts are written under this name first and renamed into place once complete
+TEMP_PREFIX = ".tgfs-part-"
+
+class ChunkCache:
+    path: Path
+    max_size: int
+    size: int
+    entries: OrderedDict[ChunkKey, int]
+    shared: bool
+
+    def __init__(self, path: str, max_size: int, shared: bool = False) -> None:
+        self.path = Path(path)
+        self.max_size = max_size
+        # When other worker processes write to the same directory, parts missing from the
+        # index are looked up on disk too
+        self.shared = shared
+        self.size = 0
+        self.entries = OrderedDict()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _file(self, key: ChunkKey) -> Path:
+        return self.path / "{}_{}_{}".format(*key)
+
+    def _load(self) -> None:
+        # Parts left over from a previous run are reused, oldest first in the LRU order.
+        # CHUNK_CACHE_DIR may be shared with other files, anything not named like a part is left alone.
+        files = []
+        for file in self.path.iterdir():
+            if file.name.startswith(TEMP_PREFIX):
+                # Left behind by a write that never finished, unless another worker is still writing it
+                if not self.shared and file.is_file():
+                    file.unlink(missing_ok=True)
+                continue
+            try:
+                key = tuple(int(x) for x in file.name.split("_"))
+            except ValueError:
+                continue
+            if len(key) != 3:
+                continue
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            if not S_ISREG(stat.st_mode):
+                continue
+            files.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(files):
+            self._add(key, size)
+        self._unlink(self._evict())
+        log.info("Loaded %d cached chunks (%d bytes) from %s", len(self.entries), self.size, self.path)
+
+    def _evict(self) -> List[Path]:
+        evicted = []
+        while self.size > self.max_size and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            evicted.append(self._file(key))
+        return evicted
+
+    @staticmethod
+    def _unlink(files: List[Path]) -> None:
+        for file in files:
+            file.unlink(missing_ok=True)
+
+    def _write(self, key: ChunkKey, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=TEMP_PREFIX)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._file(key))
+
+    async def get(self, key: ChunkKey) -> Optional[bytes]:
+        if key not in self.entries and not self.shared:
+            return None
+        try:
+            data = await asyncio.to_thread(self._file(key).read_bytes)
+        except OSError:
+            size = self.entries.pop(key, None)
+            if size is not None:
+                self.size -= size
+            return None
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        else:
+            self._add(key, len(data))
+            evicted = self._evict()
+            if evicted:
+                await asyncio.to_thread(self._unlink, evicted)
+        return data
+
+    def _add(self, key: ChunkKey, size: int) -> None:
+        self.entries[key] = size
+        self.size += size
+
+    async def put(self, key: ChunkKey, data: bytes) -> None:
+        if key in self.entries or not data or len(data) > self.max_size:
+            return
+        try:
+            await asyncio.to_thread(self._write, key, data)
+        except OSError:
+            log.warning("Failed to write chunk %s to cache", key, exc_info=True)
+            return
+        if key in self.entries:
+            return
+        self._add(key, len(data))
+        evicted = self._evict()
+        if evicted:
+            await asyncio.to_thread(self._unlink, evicted)
+
+# Workers share the directory, each one evicts down to its share of the total size
+chunk_cache: Optional[ChunkCache] = ChunkCache(Config.CHUNK_CACHE_DIR, Config.CHUNK_CACHE_SIZE // Config.WORKERS,
+                                               Config.WORKERS > 1) \
+    if Config.CHUNK_CACHE_SIZE > 0 else None
@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from os import environ
-from typing import List
+from typing import List, Optional
 
 try:
     from dotenv import load_dotenv
@@ -48,7 +48,34 @@ class Config:
     DEBUG: bool = bool(environ.get("DEBUG", None))
     EXT_DEBUG: bool = bool(environ.get("EXT_DEBUG", None))
     CONNECTION_LIMIT: int = int(environ.get("CONNECTION_LIMIT", 20))
+    PREWARM_CONNECTIONS: int = int(environ.get("PREWARM_CONNECTIONS", 1))
+    CONNECTION_IDLE_TIMEOUT: int = int(environ.get("CONNECTION_IDLE_TIMEOUT", 300))
+    CONNECTION_PING_INTERVAL: int = int(environ.get("CONNECTION_PING_INTERVAL", 60))
+    CONNECTION_PING_TIMEOUT: int = int(environ.get("CONNECTION_PING_TIMEOUT", 10))
     TOKENS: List[str] = get_multi_client_tokens()
     CACHE_SIZE: int = int(environ.get("CACHE_SIZE", 128))
     DOWNLOAD_PART_SIZE: int = int(environ.get("DOWNLOAD_PART_SIZE", 1024 * 1024))
+    DOWNLOAD_WINDOW: int = max(1, int(environ.get("DOWNLOAD_WINDOW", 8)))
+    NEGATIVE_CACHE_TTL: int = int(environ.get("NEGATIVE_CACHE_TTL", 30))
+    FILE_STORE_PATH: Optional[str] = environ.get("FILE_STORE_PATH", None)
+    RESOLVE_BATCH_DELAY: int = int(environ.get("RESOLVE_BATCH_DELAY", 10))
+    CHUNK_CACHE_DIR: str = environ.get("CHUNK_CACHE_DIR", "cache")
+    CHUNK_CACHE_SIZE: int = int(environ.get("CHUNK_CACHE_SIZE", 0))
+    PART_RETRIES: int = int(environ.get("PART_RETRIES", 3))
+    FLOOD_WAIT_THRESHOLD: int = int(environ.get("FLOOD_WAIT_THRESHOLD", 5))
+    MAX_FLOOD_WAIT: int = int(environ.get("MAX_FLOOD_WAIT", 60))
+    SENDER_THREADS: int = int(environ.get("SENDER_THREADS", 0))
+    MAX_INFLIGHT_PARTS: int = int(environ.get("MAX_INFLIGHT_PARTS", 64))
+    MAX_STREAMS_PER_IP: int = int(environ.get("MAX_STREAMS_PER_IP", 0))
+    MAX_STREAMS_PER_FILE: int = int(environ.get("MAX_STREAMS_PER_FILE", 0))
+    IP_BANDWIDTH_LIMIT: int = int(environ.get("IP_BANDWIDTH_LIMIT", 0))
+    TRUSTED_PROXIES: List[str] = [ip.strip() for ip in environ.get("TRUSTED_PROXIES", "").split(",")
+                                  if ip.strip()]
+    LINK_SECRET: Optional[str] = environ.get("LINK_SECRET", None)
+    LINK_EXPIRY: int = int(environ.get("LINK_EXPIRY", 0))
+    WORKERS: int = max(1, int(environ.get("WORKERS", 1)))
+    # Set by tgfs.server for the processes it spawns, worker 0 runs the main bot
+    WORKER_ID: int = int(environ.get("WORKER_ID", 0))
+    METRICS_PORT: int = int(environ.get("METRICS_PORT", 0))
+    PROFILER: bool = bool(environ.get("PROFILER", False))
     NO_UPDATE: bool = bool(environ.get("NO_UPDATE", False))
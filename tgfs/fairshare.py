@@ -0,0 +1,154 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+import itertools
+import time
+import weakref
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from tgfs.config import Config
+
+
+class TokenBucket:
+    rate: float
+    burst: float
+    tokens: float
+    updated: float
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    async def consume(self, amount: int) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Going into debt lets a chunk larger than the burst through, later chunks pay for it
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+@dataclass(eq=False)
+class Flow:
+    # One HTTP stream, as seen by the limiter and the part queues
+    ip: str
+    msg_id: int
+    bucket: Optional[TokenBucket] = None
+
+    @property
+    def weight(self) -> float:
+        # Every client IP gets the same share, split evenly between its streams
+        return 1 / max(1, stream_limiter.by_ip.get(self.ip, 1))
+
+
+class StreamLimiter:
+    by_ip: Dict[str, int]
+    by_file: Dict[int, int]
+    buckets: Dict[str, TokenBucket]
+
+    def __init__(self) -> None:
+        self.by_ip = {}
+        self.by_file = {}
+        self.buckets = {}
+
+    def open(self, ip: str, msg_id: int) -> Optional[Flow]:
+        if 0 < Config.MAX_STREAMS_PER_IP <= self.by_ip.get(ip, 0):
+            return None
+        if 0 < Config.MAX_STREAMS_PER_FILE <= self.by_file.get(msg_id, 0):
+            return None
+        self.by_ip[ip] = self.by_ip.get(ip, 0) + 1
+        self.by_file[msg_id] = self.by_file.get(msg_id, 0) + 1
+        bucket = None
+        if Config.IP_BANDWIDTH_LIMIT > 0:
+            # Shared by every stream of the IP, so opening more connections doesn't raise the cap
+            bucket = self.buckets.get(ip)
+            if bucket is None:
+                bucket = self.buckets[ip] = TokenBucket(Config.IP_BANDWIDTH_LIMIT, Config.IP_BANDWIDTH_LIMIT)
+        return Flow(ip, msg_id, bucket)
+
+    def close(self, flow: Flow) -> None:
+        self.by_ip[flow.ip] -= 1
+        if self.by_ip[flow.ip] == 0:
+            del self.by_ip[flow.ip]
+            self.buckets.pop(flow.ip, None)
+        self.by_file[flow.msg_id] -= 1
+        if self.by_file[flow.msg_id] == 0:
+            del self.by_file[flow.msg_id]
+
+
+class FairQueue:
+    # Limits the part requests in flight to one bot's DC. Once it is full, requests are let in
+    # by start-time fair queuing: each flow's requests are tagged 1 / weight apart in virtual
+    # time and the smallest tag goes first, so a stream asking for many parts at once only gets
+    # ahead of its own later requests, not of other streams.
+    capacity: int
+    active: int
+    virtual_time: float
+    waiting: List[Tuple[float, int, asyncio.Future]]
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.active = 0
+        self.virtual_time = 0.0
+        self.waiting = []
+        self._finish: "weakref.WeakKeyDictionary[Flow, float]" = weakref.WeakKeyDictionary()
+        self._seq = itertools.count()
+
+    def _release(self) -> None:
+        while self.waiting:
+            tag, _, future = heapq.heappop(self.waiting)
+            if future.done():
+                continue
+            # The slot goes straight to the next request
+            self.virtual_time = tag
+            future.set_result(None)
+            return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, flow: Optional[Flow]) -> AsyncGenerator[None, None]:
+        if self.capacity <= 0 or flow is None:
+            yield
+            return
+        if self.active < self.capacity and not self.waiting:
+            self.active += 1
+        else:
+            tag = max(self.virtual_time, self._finish.get(flow, 0.0)) + 1 / flow.weight
+            self._finish[flow] = tag
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiting, (tag, next(self._seq), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Cancelled right after being handed a slot
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+
+stream_limiter = StreamLimiter()
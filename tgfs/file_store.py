@@ -0,0 +1,159 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+from telethon.extensions import BinaryReader
+
+from tgfs.config import Config
+from tgfs.utils import FileInfo, InputTypeLocation
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    msg_id INTEGER PRIMARY KEY,
+    file_size INTEGER NOT NULL,
+    mime_type TEXT,
+    file_name TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    dc_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS locations (
+    msg_id INTEGER NOT NULL,
+    bot_id INTEGER NOT NULL,
+    location BLOB NOT NULL,
+    PRIMARY KEY (msg_id, bot_id)
+);
+"""
+
+@dataclass
+class StoredFile:
+    file_size: int
+    mime_type: str
+    file_name: str
+    id: int
+    dc_id: int
+    # Access hashes and file references differ between bots, so each bot keeps its own location
+    locations: Dict[int, InputTypeLocation] = field(default_factory=dict)
+
+    def for_bot(self, bot_id: int) -> Optional[FileInfo]:
+        location = self.locations.get(bot_id)
+        if location is None:
+            return None
+        return FileInfo(self.file_size, self.mime_type, self.file_name, self.id, self.dc_id, location)
+
+
+class FileStore:
+    files: OrderedDict[int, StoredFile]
+    maxsize: int
+    db: Optional[sqlite3.Connection]
+
+    def __init__(self, path: Optional[str], maxsize: int) -> None:
+        self.files = OrderedDict()
+        self.maxsize = maxsize
+        self.db = None
+        self._db_lock = threading.Lock()
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+            log.info("Using file info store at %s", path)
+
+    def _remember(self, msg_id: int, file: StoredFile) -> None:
+        self.files[msg_id] = file
+        self.files.move_to_end(msg_id)
+        if len(self.files) > self.maxsize:
+            self.files.popitem(last=False)
+
+    def _load(self, msg_id: int) -> Optional[StoredFile]:
+        with self._db_lock:
+            row = self.db.execute("SELECT file_size, mime_type, file_name, id, dc_id FROM files WHERE msg_id = ?",
+                                  (msg_id,)).fetchone()
+            if row is None:
+                return None
+            locations = self.db.execute("SELECT bot_id, location FROM locations WHERE msg_id = ?",
+                                        (msg_id,)).fetchall()
+        file = StoredFile(*row)
+        for bot_id, location in locations:
+            file.locations[bot_id] = BinaryReader(location).tgread_object()
+        return file
+
+    def _save(self, msg_id: int, bot_id: int, file: StoredFile, location: InputTypeLocation,
+              replaced: bool) -> None:
+        with self._db_lock, self.db:
+            if replaced:
+                self.db.execute("DELETE FROM locations WHERE msg_id = ?", (msg_id,))
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                (msg_id, file.file_size, file.mime_type, file.file_name, file.id, file.dc_id))
+            self.db.execute("INSERT OR REPLACE INTO locations VALUES (?, ?, ?)",
+                            (msg_id, bot_id, bytes(location)))
+
+    def _delete(self, msg_id: int, bot_id: int) -> None:
+        with self._db_lock, self.db:
+            self.db.execute("DELETE FROM locations WHERE msg_id = ? AND bot_id = ?", (msg_id, bot_id))
+
+    def peek(self, msg_id: int) -> Optional[StoredFile]:
+        return self.files.get(msg_id)
+
+    async def get(self, msg_id: int) -> Optional[StoredFile]:
+        file = self.files.get(msg_id)
+        if file is not None:
+            self.files.move_to_end(msg_id)
+            return file
+        if self.db is None:
+            return None
+        file = await asyncio.to_thread(self._load, msg_id)
+        if file is not None and msg_id not in self.files:
+            self._remember(msg_id, file)
+        return self.files.get(msg_id, file)
+
+    async def put(self, msg_id: int, bot_id: int, info: FileInfo) -> None:
+        file = await self.get(msg_id)
+        replaced = file is None or file.id != info.id or file.file_name != info.file_name
+        if replaced:
+            file = StoredFile(info.file_size, info.mime_type, info.file_name, info.id, info.dc_id)
+            self._remember(msg_id, file)
+        file.locations[bot_id] = info.location
+        if self.db is not None:
+            await asyncio.to_thread(self._save, msg_id, bot_id, file, info.location, replaced)
+
+    def _load_dc_ids(self) -> Set[int]:
+        with self._db_lock:
+            return {dc_id for dc_id, in self.db.execute("SELECT DISTINCT dc_id FROM files")}
+
+    async def dc_ids(self) -> Set[int]:
+        # DCs that hold files streamed before, and likely will be again
+        dc_ids = {file.dc_id for file in self.files.values()}
+        if self.db is not None:
+            dc_ids |= await asyncio.to_thread(self._load_dc_ids)
+        return dc_ids
+
+    async def forget(self, msg_id: int, bot_id: int) -> None:
+        file = self.files.get(msg_id)
+        if file is not None:
+            file.locations.pop(bot_id, None)
+        if self.db is not None:
+            await asyncio.to_thread(self._delete, msg_id, bot_id)
+
+file_store = FileStore(Config.FILE_STORE_PATH, Config.CACHE_SIZE)
@@ -0,0 +1,74 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+import time
+
+from tgfs.config import Config
+
+# Signed links look like /{token}/{name}. The token packs the message ID and expiry (0 = never),
+# followed by an HMAC over them and the file name, so links can be checked without any lookup
+# and keep working as long as the secret doesn't change. The Flask app in tgfs/__main__.py signs its
+# links the same way, with the expiry followed by the Bot API file_id as the payload.
+TOKEN_FORMAT = ">qI"
+SIGNATURE_SIZE = 12
+
+_secret = (Config.LINK_SECRET or hashlib.sha256(f"links:{Config.BOT_TOKEN}".encode()).hexdigest()).encode()
+
+
+class InvalidLink(Exception):
+    pass
+
+
+class ExpiredLink(InvalidLink):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(payload: bytes, file_name: str) -> bytes:
+    return hmac.new(_secret, payload + file_name.encode(), hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def sign_link(msg_id: int, file_name: str) -> str:
+    expires = int(time.time()) + Config.LINK_EXPIRY if Config.LINK_EXPIRY > 0 else 0
+    payload = struct.pack(TOKEN_FORMAT, msg_id, expires)
+    return f"{_b64encode(payload)}.{_b64encode(_signature(payload, file_name))}"
+
+
+def verify_link(token: str, file_name: str) -> int:
+    payload, _, signature = token.partition(".")
+    try:
+        payload_bytes = _b64decode(payload)
+        signature_bytes = _b64decode(signature)
+        msg_id, expires = struct.unpack(TOKEN_FORMAT, payload_bytes)
+    except (binascii.Error, ValueError, struct.error) as e:
+        raise InvalidLink(token) from e
+    if not hmac.compare_digest(signature_bytes, _signature(payload_bytes, file_name)):
+        raise InvalidLink(token)
+    if expires and expires < time.time():
+        raise ExpiredLink(token)
+    return msg_id
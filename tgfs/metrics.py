@@ -0,0 +1,164 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import threading
+import time
+
+from typing import Callable, Dict, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# Collectors are called before every scrape to refresh gauges that are read from live objects
+collectors: List[Callable[[], None]] = []
+registry: List["Metric"] = []
+# Added to every sample, tgfs.server sets the worker so processes sharing a port can be told apart
+const_labels: Dict[str, str] = {}
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in const_labels.items()]
+    pairs.extend(f'{name}="{value}"' for name, value in zip(names, values))
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Some metrics are updated from sender threads
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: object) -> None:
+        # Used to mirror counts that are kept by another object
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def clear(self) -> None:
+        with self._lock:
+            self.values.clear()
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+                self.sums[key] = 0.0
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sums[key] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            snapshot = [(key, list(counts), self.sums[key]) for key, counts in self.counts.items()]
+        lines = []
+        for key, counts, total_sum in snapshot:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total_sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {total}")
+        return lines
+
+
+def render() -> str:
+    for collector in collectors:
+        collector()
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+bytes_served = Counter("tgfs_bytes_served_total", "Bytes sent to HTTP clients", ("bot", "dc"))
+part_fetch_seconds = Histogram("tgfs_part_fetch_seconds", "Time taken by a GetFileRequest", ("dc",))
+time_to_first_byte = Histogram("tgfs_time_to_first_byte_seconds",
+                               "Time from receiving a file request to sending its first byte")
+streams_aborted = Counter("tgfs_streams_aborted_total", "Streams closed before the whole range was sent",
+                          ("reason",))
+flood_waits = Counter("tgfs_flood_waits_total", "FloodWaitErrors received while fetching parts", ("bot",))
+flood_wait_seconds = Counter("tgfs_flood_wait_seconds_total", "Seconds of flood wait imposed on a bot", ("bot",))
+chunk_cache_requests = Counter("tgfs_chunk_cache_requests_total", "Chunk cache lookups", ("result",))
+file_cache_requests = Counter("tgfs_file_cache_requests_total", "File info cache lookups per bot", ("bot", "result"))
+file_cache_evictions = Counter("tgfs_file_cache_evictions_total", "File infos dropped to make room in the cache",
+                               ("bot",))
+file_cache_entries = Gauge("tgfs_file_cache_entries", "File infos held in the cache", ("bot",))
+file_cache_bytes = Gauge("tgfs_file_cache_bytes", "Size of the file infos held in the cache", ("bot",))
+connections = Gauge("tgfs_connections", "Open MTProto connections", ("bot", "dc"))
+active_streams = Gauge("tgfs_active_streams", "Streams being served", ("bot",))
+buffered_parts = Gauge("tgfs_buffered_parts", "Parts prefetched and waiting to be sent", ("bot",))
+loop_lag = Histogram("tgfs_event_loop_lag_seconds", "How late the event loop woke up from a sleep",
+                     buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+decrypt_seconds = Counter("tgfs_decrypt_seconds_total", "Time spent decrypting MTProto responses", ("dc",))
+decrypted_bytes = Counter("tgfs_decrypted_bytes_total", "Bytes of MTProto responses decrypted", ("dc",))
+stream_dc_wait_seconds = Histogram("tgfs_stream_dc_wait_seconds",
+                                   "Time a stream spent waiting for parts from Telegram")
+stream_backpressure_seconds = Histogram("tgfs_stream_backpressure_seconds",
+                                        "Time a stream spent waiting for the HTTP client to accept data")
+process_cpu_seconds = Counter("tgfs_process_cpu_seconds_total", "CPU time used by this process")
+
+collectors.append(lambda: process_cpu_seconds.set(time.process_time()))
@@ -20,40 +20,87 @@
 # pylint: disable=protected-access
 
 import copy
-from collections import OrderedDict
-from typing import AsyncGenerator, Dict, Optional, List
+from typing import Any, AsyncGenerator, Awaitable, Coroutine, Dict, Optional, List, Set, TypeVar
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 import logging
 import asyncio
 import math
+import random
+import time
 
 from telethon import TelegramClient
 from telethon.crypto import AuthKey
 from telethon.network import MTProtoSender
 from telethon.tl.alltlobjects import LAYER
-from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions import InvokeWithLayerRequest, PingRequest
 from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
 from telethon.tl.functions.upload import GetFileRequest
 from telethon.tl.types import DcOption
-from telethon.errors import DcIdInvalidError, FloodWaitError
+from telethon.errors import DcIdInvalidError, FloodWaitError, ServerError, TimedOutError
 
+from tgfs import metrics
 from tgfs.config import Config
+from tgfs.cache_util import AsyncLRUCache
+from tgfs.chunk_cache import chunk_cache, ChunkKey
+from tgfs.fairshare import FairQueue, Flow
+from tgfs.file_store import file_store
+from tgfs.profiling import time_decryption
+from tgfs.readahead import ReadAhead
+from tgfs.sender_pool import SenderThread, next_sender_thread
 from tgfs.utils import get_fileinfo, FileInfo, InputTypeLocation
 
 root_log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Weight of the newest sample in the moving average of part latencies
+LATENCY_SMOOTHING = 0.2
+# Part latency assumed until a bot has fetched one, so streams already given to a cold bot count
+INITIAL_PART_LATENCY = 0.25
+# Estimated cost in seconds of opening the first connection (and exporting auth) to a DC
+NEW_DC_COST = 1.0
+# Smallest limit accepted by upload.getFile, every allowed limit is a multiple of it dividing 1 MiB
+MIN_PART_SIZE = 4096
+# Errors after which a part request is worth repeating as is
+TRANSIENT_ERRORS = (OSError, asyncio.TimeoutError, ServerError, TimedOutError)
+
 if Config.CONNECTION_LIMIT > 25:
     root_log.warning("The connection limit should not be set above 25 to avoid"
                      " infinite disconnect/reconnect loops")
 
 
+@dataclass
+class SharedPart:
+    task: asyncio.Task
+    waiters: int = 0
+
+# Parts currently being fetched, shared by every stream that asks for the same part of a file
+shared_parts: Dict[ChunkKey, SharedPart] = {}
+
+
 @dataclass
 class Connection:
     log: logging.Logger
     sender: MTProtoSender
-    lock: asyncio.Lock
     users: int = 0
+    last_used: float = 0.0
+    thread: Optional[SenderThread] = None
+    # Dropped from the pool while still in use, closed once the last user is done with it
+    retired: bool = False
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> Awaitable[T]:
+        # A sender may only be used from the loop it was created on
+        return coro if self.thread is None else self.thread.run(coro)
+
+    async def _send(self, request: Any) -> Any:
+        return await self.sender.send(request)
+
+    def send(self, request: Any) -> Awaitable[Any]:
+        return self.run(self._send(request))
+
+    def disconnect(self) -> Awaitable[None]:
+        return self.run(self.sender.disconnect())
 
 
 class DCConnectionManager:
@@ -64,8 +111,12 @@ class DCConnectionManager:
     dc: Optional[DcOption]
     auth_key: Optional[AuthKey]
     connections: List[Connection]
+    queue: FairQueue
+    # Whether PREWARM_CONNECTIONS are kept open to this DC
+    warm: bool
 
-    _list_lock: asyncio.Lock
+    _creating: Optional[asyncio.Task]
+    _closing: Set[asyncio.Future]
 
     def __init__(self, client: TelegramClient, dc_id: int, log: logging.Logger) -> None:
         self.log = log.getChild(f"dc{dc_id}")
@@ -73,26 +124,57 @@ class DCConnectionManager:
         self.dc_id = dc_id
         self.auth_key = None
         self.connections = []
-        self._list_lock = asyncio.Lock()
+        self.queue = FairQueue(Config.MAX_INFLIGHT_PARTS)
+        self.warm = False
+        self._creating = None
+        self._closing = set()
+        self._conn_index = 0
         self.dc = None
 
+    async def _connect_sender(self) -> MTProtoSender:
+        sender = MTProtoSender(self.auth_key, loggers=self.client._log)
+        time_decryption(sender, self.dc_id)
+        connection_info = self.client._connection(self.dc.ip_address, self.dc.port, self.dc.id,
+                                                  loggers=self.client._log,
+                                                  proxy=self.client._proxy)
+        try:
+            await sender.connect(connection_info)
+        except BaseException:
+            await sender.disconnect()
+            raise
+        return sender
+
     async def _new_connection(self) -> Connection:
         if not self.dc:
             self.dc = await self.client._get_dc(self.dc_id)
-        sender = MTProtoSender(self.auth_key, loggers=self.client._log)
-        index = len(self.connections) + 1
-        conn = Connection(sender=sender, log=self.log.getChild(
-            f"conn{index}"), lock=asyncio.Lock())
-        self.connections.append(conn)
-        async with conn.lock:
-            conn.log.info("Connecting...")
-            connection_info = self.client._connection(self.dc.ip_address, self.dc.port, self.dc.id,
-                                                      loggers=self.client._log,
-                                                      proxy=self.client._proxy)
-            await sender.connect(connection_info)
+        self._conn_index += 1
+        conn = Connection(sender=None, log=self.log.getChild(f"conn{self._conn_index}"),
+                          last_used=time.monotonic(), thread=next_sender_thread())
+        conn.log.info("Connecting...")
+        conn.sender = await conn.run(self._connect_sender())
+        try:
             if not self.auth_key:
                 await self._export_auth_key(conn)
-            return conn
+        except BaseException:
+            await conn.disconnect()
+            raise
+        # Only published once it is usable, so nobody ever waits on a handshake they didn't ask for
+        self.connections.append(conn)
+        # Files are served from this DC, keep it ready from now on
+        self.warm = True
+        return conn
+
+    def _connection_created(self, task: asyncio.Task) -> None:
+        self._creating = None
+        if not task.cancelled() and task.exception() is not None:
+            self.log.warning("Failed to open a new connection: %s", task.exception())
+
+    def _spawn_connection(self) -> asyncio.Task:
+        # At most one connection is being opened at a time, which also serializes the auth export
+        if self._creating is None:
+            self._creating = asyncio.create_task(self._new_connection())
+            self._creating.add_done_callback(self._connection_created)
+        return self._creating
 
     async def _export_auth_key(self, conn: Connection) -> None:
         self.log.info(f"Exporting auth to DC {self.dc.id}"
@@ -111,33 +193,79 @@ class DCConnectionManager:
         req = InvokeWithLayerRequest(
             LAYER, init_request
         )
-        await conn.sender.send(req)
+        await conn.send(req)
         self.auth_key = conn.sender.auth_key
 
-    async def _next_connection(self) -> Connection:
+    def _least_busy(self) -> Optional[Connection]:
         best_conn: Optional[Connection] = None
         for conn in self.connections:
             if not best_conn or conn.users < best_conn.users:
                 best_conn = conn
-        if (not best_conn or best_conn.users > 0) and len(self.connections) < Config.CONNECTION_LIMIT:
-            best_conn = await self._new_connection()
         return best_conn
 
     @asynccontextmanager
     async def get_connection(self) -> AsyncGenerator[Connection, None]:
-        async with self._list_lock:
-            conn: Connection = await asyncio.shield(self._next_connection())
-            # The connection is locked so reconnections don't stack
-            async with conn.lock:
-                conn.users += 1
+        conn = self._least_busy()
+        if (not conn or conn.users > 0) and len(self.connections) < Config.CONNECTION_LIMIT:
+            task = self._spawn_connection()
+            if not conn:
+                conn = await asyncio.shield(task)
+        conn.users += 1
         try:
             yield conn
         finally:
             conn.users -= 1
+            conn.last_used = time.monotonic()
+            if conn.retired and conn.users == 0:
+                self._close(conn)
+
+    def _close(self, conn: Connection) -> None:
+        future = asyncio.ensure_future(conn.disconnect())
+        self._closing.add(future)
+        future.add_done_callback(lambda _: self._closing.discard(future))
+
+    async def prewarm(self, count: int) -> None:
+        # Opens connections (and exports auth) before the first request for this DC arrives
+        while len(self.connections) < min(count, Config.CONNECTION_LIMIT):
+            await asyncio.shield(self._spawn_connection())
+
+    async def _is_alive(self, conn: Connection) -> bool:
+        if not conn.sender.is_connected():
+            return False
+        try:
+            await asyncio.wait_for(conn.send(PingRequest(random.getrandbits(63))),
+                                   Config.CONNECTION_PING_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def maintain(self) -> None:
+        now = time.monotonic()
+        idle = [conn for conn in self.connections
+                if conn.users == 0 and now - conn.last_used > Config.CONNECTION_IDLE_TIMEOUT]
+        keep = Config.PREWARM_CONNECTIONS if self.warm else 0
+        idle = idle[:max(0, len(self.connections) - keep)]
+        for conn in idle:
+            conn.log.info("Closing idle connection")
+            self.connections.remove(conn)
+        # A ping would only queue behind the requests of a connection in use
+        checked = [conn for conn in self.connections if conn.users == 0]
+        alive = await asyncio.gather(*[self._is_alive(conn) for conn in checked])
+        dead = [conn for conn, ok in zip(checked, alive) if not ok and conn in self.connections]
+        for conn in dead:
+            conn.log.warning("Connection stopped responding, replacing it")
+            self.connections.remove(conn)
+            if conn.users > 0:
+                # Picked up during the ping, closed by get_connection once released
+                conn.retired = True
+        await asyncio.gather(*[conn.disconnect() for conn in idle + dead if not conn.retired],
+                             return_exceptions=True)
+        await self.prewarm(keep)
 
     async def disconnect(self) -> None:
-        async with self._list_lock:
-            await asyncio.gather(*[conn.sender.disconnect() for conn in self.connections])
+        if self._creating:
+            self._creating.cancel()
+        await asyncio.gather(*[conn.disconnect() for conn in self.connections], *self._closing)
 
 
 class ParallelTransferrer:
@@ -146,14 +274,27 @@ class ParallelTransferrer:
     dc_managers: Dict[int, DCConnectionManager]
     users: int
     active_clients: int
-    cached_files: OrderedDict[int, asyncio.Task[FileInfo]]
+    client_id: int
+    file_cache: AsyncLRUCache
+    _maintenance_task: Optional[asyncio.Task]
+    readaheads: Set[ReadAhead]
+    inflight_parts: int
+    part_latency: float
+    flood_wait_until: float
 
     def __init__(self, client: TelegramClient, client_id: int) -> None:
         self.log = root_log.getChild(f"bot{client_id}")
         self.client = client
+        self.client_id = client_id
         self.users = 0
         self.active_clients = 0
-        self.cached_files = OrderedDict()
+        self.file_cache = AsyncLRUCache(self._resolve_file, Config.CACHE_SIZE, False,
+                                        negative_ttl=Config.NEGATIVE_CACHE_TTL)
+        self.readaheads = set()
+        self.inflight_parts = 0
+        self.part_latency = INITIAL_PART_LATENCY
+        self.flood_wait_until = 0.0
+        self._maintenance_task = None
         self.dc_managers = {
             1: DCConnectionManager(client, 1, self.log),
             2: DCConnectionManager(client, 2, self.log),
@@ -162,10 +303,53 @@ class ParallelTransferrer:
             5: DCConnectionManager(client, 5, self.log),
         }
 
+    @property
+    def buffered_parts(self) -> int:
+        return sum(readahead.buffered for readahead in self.readaheads)
+
+    def load_score(self, dc_id: Optional[int]) -> float:
+        # Rough estimate in seconds of how long a new stream would wait for its first part
+        score = max(0.0, self.flood_wait_until - time.monotonic())
+        dcm = self.dc_managers.get(dc_id)
+        if dcm is None:
+            connections = sum(len(dcm.connections) for dcm in self.dc_managers.values())
+        elif dcm.connections:
+            connections = len(dcm.connections)
+        else:
+            connections = 0
+            score += NEW_DC_COST
+        score += (self.inflight_parts + self.active_clients + 1) * self.part_latency / max(1, connections)
+        return score
+
     def post_init(self) -> None:
         self.dc_managers[self.client.session.dc_id].auth_key = self.client.session.auth_key
+        self.dc_managers[self.client.session.dc_id].warm = True
+        self._maintenance_task = asyncio.create_task(self._maintain_connections())
+
+    async def _maintain_connections(self) -> None:
+        # Exporting auth to every DC at startup invites flood waits, only DCs files were
+        # served from before are prepared, the others on their first request
+        for dc_id in await file_store.dc_ids():
+            if dc_id in self.dc_managers:
+                self.dc_managers[dc_id].warm = True
+        if Config.PREWARM_CONNECTIONS > 0:
+            warm = {dc_id: dcm for dc_id, dcm in self.dc_managers.items() if dcm.warm}
+            results = await asyncio.gather(*[dcm.prewarm(Config.PREWARM_CONNECTIONS)
+                                             for dcm in warm.values()], return_exceptions=True)
+            for dc_id, result in zip(warm, results):
+                if isinstance(result, Exception):
+                    self.log.warning("Failed to prewarm connections to DC %d: %s", dc_id, result)
+        while True:
+            await asyncio.sleep(Config.CONNECTION_PING_INTERVAL)
+            for dc_id, dcm in self.dc_managers.items():
+                try:
+                    await dcm.maintain()
+                except Exception:
+                    self.log.warning("Maintaining connections to DC %d failed", dc_id, exc_info=True)
 
     async def close_connection(self) -> None:
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
         task = []
         for dcid, dcm in self.dc_managers.items():
             if dcm.connections:
@@ -175,70 +359,180 @@ class ParallelTransferrer:
             await asyncio.gather(*task)
         self.log.debug("All DC connections closed")
 
+    async def _resolve_file(self, message_id: int, file_name: str) -> Optional[FileInfo]:
+        file = await get_fileinfo(self.client, message_id, file_name)
+        if file:
+            await file_store.put(message_id, self.client_id, file)
+        return file
+
     async def get_file(self, message_id: int, file_name: str) -> Optional[FileInfo]:
-        if message_id in self.cached_files:
-            file = await self.cached_files[message_id]
-            return file if file and file.file_name == file_name else None
-        task = asyncio.create_task(get_fileinfo(self.client, message_id, file_name))
-        if Config.CACHE_SIZE is not None and len(self.cached_files) > Config.CACHE_SIZE:
-            self.cached_files.popitem(last=False)
-        self.cached_files[message_id] = task
-        file_id = await task
-        if not file_id:
-            self.cached_files.pop(message_id)
+        stored = await file_store.get(message_id)
+        if stored:
+            if stored.file_name != file_name:
+                return None
+            file = stored.for_bot(self.client_id)
+            if file:
+                return file
+        file = await self.file_cache(message_id, file_name)
+        if not file:
             self.log.debug("File not found for message with ID %s", message_id)
             return None
         self.log.debug("Generated file ID for message with ID %s", message_id)
-        return file_id
+        return file
+
+    async def forget_file(self, message_id: int, file_name: str) -> None:
+        self.file_cache.invalidate(message_id, file_name)
+        await file_store.forget(message_id, self.client_id)
+
+    async def _request_part(self, dcm: DCConnectionManager, location: InputTypeLocation,
+                            offset: int, limit: int, flow: Optional[Flow]) -> bytes:
+        self.inflight_parts += 1
+        try:
+            async with dcm.queue.slot(flow), dcm.get_connection() as conn:
+                start = time.monotonic()
+                request = GetFileRequest(location, offset=offset, limit=limit)
+                if conn.thread is None:
+                    # Flood waits are handled by _fetch_part instead of sleeping inside telethon
+                    result = await self.client._call(conn.sender, request, flood_sleep_threshold=0)
+                else:
+                    # client._call refuses to run outside the client's loop, errors come back the same way
+                    result = await conn.send(request)
+                elapsed = time.monotonic() - start
+                self.part_latency += (elapsed - self.part_latency) * LATENCY_SMOOTHING
+                metrics.part_fetch_seconds.observe(elapsed, dc=dcm.dc_id)
+                return result.bytes
+        except FloodWaitError as e:
+            self.flood_wait_until = max(self.flood_wait_until, time.monotonic() + e.seconds)
+            metrics.flood_waits.inc(bot=self.client_id)
+            metrics.flood_wait_seconds.inc(e.seconds, bot=self.client_id)
+            raise
+        finally:
+            self.inflight_parts -= 1
+
+    async def _fetch_part(self, dcm: DCConnectionManager, location: InputTypeLocation,
+                          offset: int, limit: int, flow: Optional[Flow]) -> bytes:
+        attempt = 0
+        while True:
+            try:
+                return await self._request_part(dcm, location, offset, limit, flow)
+            except FloodWaitError as e:
+                # Longer waits are left to the caller, which can move the stream to another bot
+                if e.seconds > Config.FLOOD_WAIT_THRESHOLD:
+                    raise
+                self.log.info("Flood wait of %ds on DC %d, retrying offset %d", e.seconds, dcm.dc_id, offset)
+                await asyncio.sleep(e.seconds)
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt > Config.PART_RETRIES:
+                    raise
+                self.log.warning("Fetching offset %d from DC %d failed (%s), retry %d/%d", offset, dcm.dc_id,
+                                 e, attempt, Config.PART_RETRIES)
+                await asyncio.sleep(min(2 ** (attempt - 1), 10))
+
+    async def _load_part(self, dcm: DCConnectionManager, file: FileInfo, part: int, part_size: int,
+                         flow: Optional[Flow]) -> bytes:
+        if chunk_cache is None:
+            return await self._fetch_part(dcm, file.location, part * part_size, part_size, flow)
+        key = (file.id, part_size, part)
+        data = await chunk_cache.get(key)
+        if data is None and part_size < Config.DOWNLOAD_PART_SIZE:
+            # A small part may be inside a full sized one that is already cached
+            parent, start = divmod(part * part_size, Config.DOWNLOAD_PART_SIZE)
+            data = await chunk_cache.get((file.id, Config.DOWNLOAD_PART_SIZE, parent))
+            if data is not None:
+                data = data[start:start + part_size]
+        if data is not None:
+            metrics.chunk_cache_requests.inc(result="hit")
+            return data
+        metrics.chunk_cache_requests.inc(result="miss")
+        data = await self._fetch_part(dcm, file.location, part * part_size, part_size, flow)
+        await chunk_cache.put(key, data)
+        return data
+
+    async def _get_part(self, dcm: DCConnectionManager, file: FileInfo, part: int, part_size: int,
+                        flow: Optional[Flow]) -> bytes:
+        key = (file.id, part_size, part)
+        shared = shared_parts.get(key)
+        if shared is None:
+            # Queued as the stream that asked first, the others ride along for free
+            shared = SharedPart(asyncio.create_task(self._load_part(dcm, file, part, part_size, flow)))
+            shared_parts[key] = shared
+            shared.task.add_done_callback(lambda _: shared_parts.pop(key, None)
+                                          if shared_parts.get(key) is shared else None)
+        else:
+            self.log.debug("Joined in-flight request for part %d of %d", part, file.id)
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        finally:
+            shared.waiters -= 1
+            # Nobody is reading this part anymore, so stop fetching it
+            if shared.waiters == 0 and not shared.task.done():
+                shared.task.cancel()
+                if shared_parts.get(key) is shared:
+                    del shared_parts[key]
 
-    async def _int_download(self, request: GetFileRequest, first_part: int, last_part: int,
-        part_count: int, part_size: int, dc_id: int, first_part_cut: int,
-        last_part_cut: int) -> AsyncGenerator[bytes, None]:
+    async def _int_download(self, file: FileInfo, first_part: int, last_part: int, part_count: int,
+        part_size: int, first_part_cut: int, last_part_cut: int,
+        flow: Optional[Flow]) -> AsyncGenerator[memoryview, None]:
         log = self.log
         self.users += 1
+        dcm = self.dc_managers[file.dc_id]
+        readahead = ReadAhead(lambda part: self._get_part(dcm, file, part, part_size, flow),
+                              first_part, last_part, Config.DOWNLOAD_WINDOW)
+        self.readaheads.add(readahead)
         try:
             part = first_part
-            dcm = self.dc_managers[dc_id]
-            async with dcm.get_connection() as conn:
-                log = conn.log
-                while part <= last_part:
-                    result = await self.client._call(conn.sender, request)
-
-                    if not result.bytes:
-                        break
-
-                    request.offset += part_size
-                    if last_part == first_part:
-                        yield result.bytes[first_part:last_part]
-                    elif part == first_part:
-                        yield result.bytes[first_part_cut:]
-                    elif part == last_part:
-                        yield result.bytes[:last_part_cut]
-                    else:
-                        yield result.bytes
-                    log.debug("Part %d/%d (total %d) downloaded", part, last_part, part_count)
-                    part += 1
-                log.info("Parallel download finished")
+            while part <= last_part:
+                data = await readahead.next()
+
+                if not data:
+                    break
+
+                # Slicing a memoryview doesn't copy the part
+                data = memoryview(data)
+                if last_part == first_part:
+                    yield data[first_part_cut:last_part_cut]
+                elif part == first_part:
+                    yield data[first_part_cut:]
+                elif part == last_part:
+                    yield data[:last_part_cut]
+                else:
+                    yield data
+                log.debug("Part %d/%d (total %d) downloaded, %d/%d buffered", part, last_part,
+                          part_count, readahead.buffered, readahead.window)
+                part += 1
+            log.info("Parallel download finished")
         except (GeneratorExit, StopAsyncIteration, asyncio.CancelledError):
             log.info("Parallel download interrupted")
             raise
         except Exception:
             log.error("Parallel download errored", exc_info=True)
+            raise
         finally:
-            self.active_clients -= 1
+            readahead.close()
+            self.readaheads.discard(readahead)
             self.users -= 1
 
-    def download(self, location: InputTypeLocation, dc_id: int, file_size: int, offset: int, limit: int
-                 ) -> AsyncGenerator[bytes, None]:
-        part_size = Config.DOWNLOAD_PART_SIZE
-        first_part_cut = offset % part_size
-        first_part = math.floor(offset / part_size)
-        last_part_cut = (limit % part_size) + 1
-        last_part = math.ceil(limit / part_size)
-        part_count = math.ceil(file_size / part_size)
-        self.log.info("Starting parallel download: chunks %d-%d of %d %s",
-                       first_part, last_part, part_count, location)
-        request = GetFileRequest(location, offset=first_part * part_size, limit=part_size)
-
-        return self._int_download(request, first_part, last_part, part_count, part_size, dc_id,
-                                  first_part_cut, last_part_cut)
+    @staticmethod
+    def choose_part_size(length: int) -> int:
+        # Small ranges (players probing headers, the moov atom or the end of the file) fetch
+        # small parts, anything larger uses full sized parts.
+        part_size = MIN_PART_SIZE
+        while part_size < length and part_size < Config.DOWNLOAD_PART_SIZE:
+            part_size *= 2
+        return part_size
+
+    def download(self, file: FileInfo, offset: int, limit: int,
+                 flow: Optional[Flow] = None) -> AsyncGenerator[memoryview, None]:
+        part_size = self.choose_part_size(limit - offset + 1)
+        # offset and limit are the first and last byte of the range, both inclusive
+        first_part, first_part_cut = divmod(offset, part_size)
+        last_part, last_part_cut = divmod(limit, part_size)
+        last_part_cut += 1
+        part_count = math.ceil(file.file_size / part_size)
+        self.log.info("Starting parallel download: chunks %d-%d of %d (%d bytes each) %s",
+                       first_part, last_part, part_count, part_size, file.location)
+
+        return self._int_download(file, first_part, last_part, part_count, part_size,
+                                  first_part_cut, last_part_cut, flow)
@@ -21,6 +21,7 @@ from telethon import events
 from telethon.custom import Message
 
 from tgfs.config import Config
+from tgfs.links import sign_link
 from tgfs.telegram import client
 from tgfs.utils import get_filename
 
@@ -33,6 +34,7 @@ async def handle_text_message(evt: events.NewMessage.Event) -> None:
 @client.on(events.NewMessage(incoming=True, func=lambda x: x.is_private and x.file))
 async def handle_file_message(evt: events.NewMessage.Event) -> None:
     fwd_msg: Message = await evt.message.forward_to(Config.BIN_CHANNEL)
-    url = f"{Config.PUBLIC_URL}/{fwd_msg.id}/{parse.quote(get_filename(evt))}"
+    file_name = get_filename(evt)
+    url = f"{Config.PUBLIC_URL}/{sign_link(fwd_msg.id, file_name)}/{parse.quote(file_name)}"
     await evt.reply(url)
     log.info("Generated Link %s", url)
@@ -0,0 +1,82 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+from dataclasses import dataclass
+
+from telethon.network import MTProtoSender
+
+from tgfs import metrics
+
+# How often the event loop is checked for lag
+LOOP_LAG_INTERVAL = 0.5
+
+
+@dataclass
+class StreamTimings:
+    # Seconds a stream spent waiting for parts from Telegram and for the HTTP client to take them
+    dc_wait: float = 0.0
+    backpressure: float = 0.0
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    # A sleep that wakes up late means callbacks were queued behind something hogging the loop
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.loop_lag.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+def time_decryption(sender: MTProtoSender, dc_id: int) -> None:
+    state = sender._state  # pylint: disable=protected-access
+    decrypt = state.decrypt_message_data
+
+    def timed_decrypt(body: bytes):
+        start = time.perf_counter()
+        try:
+            return decrypt(body)
+        finally:
+            metrics.decrypt_seconds.inc(time.perf_counter() - start, dc=dc_id)
+            metrics.decrypted_bytes.inc(len(body), dc=dc_id)
+
+    state.decrypt_message_data = timed_decrypt
+
+
+def sample_stacks(seconds: float, interval: float) -> Counter:
+    # Samples the stack of every other thread, in the collapsed format read by flamegraph tools
+    own = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks: Counter = Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
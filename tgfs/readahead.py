@@ -0,0 +1,75 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+
+from collections import deque
+from typing import Awaitable, Callable, Deque
+
+# Parts requested ahead from the start, the first ones decide the time to first byte
+INITIAL_WINDOW = 4
+
+
+class ReadAhead:
+    # Fetches the parts of a range in order, keeping up to `window` of them requested ahead of
+    # the reader. The window starts at INITIAL_WINDOW, doubles every time the reader has to wait
+    # for a part and shrinks by one whenever the reader comes back to a full buffer, so fast
+    # sequential readers get deep prefetching while slow clients don't pin parts in memory.
+    fetch: Callable[[int], Awaitable[bytes]]
+    next_part: int
+    last_part: int
+    window: int
+    max_window: int
+    pending: Deque[asyncio.Task]
+
+    def __init__(self, fetch: Callable[[int], Awaitable[bytes]], first_part: int, last_part: int,
+                 max_window: int) -> None:
+        self.fetch = fetch
+        self.next_part = first_part
+        self.last_part = last_part
+        self.max_window = max(1, max_window)
+        self.window = min(INITIAL_WINDOW, self.max_window)
+        self.pending = deque()
+        self._reads = 0
+
+    @property
+    def buffered(self) -> int:
+        return sum(1 for task in self.pending if task.done())
+
+    def _fill(self) -> None:
+        while self.next_part <= self.last_part and len(self.pending) < self.window:
+            self.pending.append(asyncio.create_task(self.fetch(self.next_part)))
+            self.next_part += 1
+
+    async def next(self) -> bytes:
+        self._fill()
+        if self.buffered >= self.window:
+            self.window = max(1, self.window - 1)
+        task = self.pending.popleft()
+        if not task.done() and self._reads > 0:
+            self.window = min(self.max_window, self.window * 2)
+        self._reads += 1
+        self._fill()
+        return await task
+
+    def close(self) -> None:
+        for task in self.pending:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # Retrieve the exception of parts that failed but were never read
+                task.exception()
+        self.pending.clear()
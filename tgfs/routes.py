@@ -16,8 +16,20 @@
 
 import logging
 import asyncio
-from aiohttp import web
+import math
+import time
+from typing import AsyncGenerator, Optional, Tuple
 
+from aiohttp import hdrs, web
+from telethon.errors import FileReferenceExpiredError
+
+from tgfs import metrics
+from tgfs.config import Config
+from tgfs.fairshare import Flow, stream_limiter
+from tgfs.file_store import file_store
+from tgfs.links import ExpiredLink, InvalidLink, verify_link
+from tgfs.paralleltransfer import ParallelTransferrer
+from tgfs.profiling import StreamTimings, sample_stacks
 from tgfs.telegram import multi_clients
 from tgfs.utils import FileInfo
 
@@ -25,51 +37,236 @@ log = logging.getLogger(__name__)
 routes = web.RouteTableDef()
 
 client_selection_lock = asyncio.Lock()
+profile_lock = asyncio.Lock()
+PROFILE_MAX_SECONDS = 60
+
+def select_client(dc_id: Optional[int]) -> int:
+    return min(multi_clients, key=lambda k: multi_clients[k].load_score(dc_id))
+
+def collect_client_metrics() -> None:
+    metrics.connections.clear()
+    for client_id, transfer in multi_clients.items():
+        for dc_id, dcm in transfer.dc_managers.items():
+            if dcm.connections:
+                metrics.connections.set(len(dcm.connections), bot=client_id, dc=dc_id)
+        metrics.active_streams.set(transfer.users, bot=client_id)
+        metrics.buffered_parts.set(transfer.buffered_parts, bot=client_id)
+        stats = transfer.file_cache.stats
+        metrics.file_cache_requests.set(stats["hits"], bot=client_id, result="hit")
+        metrics.file_cache_requests.set(stats["misses"], bot=client_id, result="miss")
+        metrics.file_cache_evictions.set(stats["evictions"], bot=client_id)
+        metrics.file_cache_entries.set(stats["entries"], bot=client_id)
+        metrics.file_cache_bytes.set(stats["bytes"], bot=client_id)
+
+metrics.collectors.append(collect_client_metrics)
+
+async def resume_stream(transfer: ParallelTransferrer, msg_id: int, file: FileInfo, offset: int,
+                        error: Exception) -> Tuple[ParallelTransferrer, FileInfo]:
+    # Hand the rest of the range to the bot that can serve it soonest instead of truncating
+    if isinstance(error, FileReferenceExpiredError):
+        await transfer.forget_file(msg_id, file.file_name)
+    client_id = select_client(file.dc_id)
+    transfer = multi_clients[client_id]
+    wait = transfer.flood_wait_until - time.monotonic()
+    if wait > Config.MAX_FLOOD_WAIT:
+        raise error
+    log.warning("Stream of %s failed at byte %d (%s), continuing on client %d", file.file_name,
+                offset, type(error).__name__, client_id)
+    if wait > 0:
+        await asyncio.sleep(wait)
+    transfer.active_clients += 1
+    try:
+        new_file = await transfer.get_file(msg_id, file.file_name)
+    except Exception:
+        transfer.active_clients -= 1
+        raise
+    if not new_file:
+        transfer.active_clients -= 1
+        raise error
+    return transfer, new_file
+
+async def stream_file(transfer: ParallelTransferrer, msg_id: int, file: FileInfo, from_bytes: int,
+                      until_bytes: int, started: float, flow: Optional[Flow]) -> AsyncGenerator[memoryview, None]:
+    offset = from_bytes
+    migrations = 0
+    picked = transfer
+    timings = StreamTimings()
+    mark = time.monotonic()
+    try:
+        while True:
+            try:
+                async for chunk in transfer.download(file, offset, until_bytes, flow):
+                    now = time.monotonic()
+                    timings.dc_wait += now - mark
+                    if offset == from_bytes:
+                        metrics.time_to_first_byte.observe(now - started)
+                    offset += len(chunk)
+                    metrics.bytes_served.inc(len(chunk), bot=transfer.client_id, dc=file.dc_id)
+                    yield chunk
+                    # The consumer resumes us once the chunk has been handed to the transport
+                    mark = time.monotonic()
+                    timings.backpressure += mark - now
+                return
+            except (GeneratorExit, asyncio.CancelledError):
+                metrics.streams_aborted.inc(reason="client")
+                raise
+            except Exception as e:
+                migrations += 1
+                try:
+                    if offset > until_bytes or migrations > len(multi_clients):
+                        raise
+                    new_transfer, file = await resume_stream(transfer, msg_id, file, offset, e)
+                except Exception:
+                    metrics.streams_aborted.inc(reason="error")
+                    raise
+                # The stream's slot moves with it
+                transfer.active_clients -= 1
+                transfer = new_transfer
+    finally:
+        if transfer is not picked:
+            # serve_file releases the client it picked
+            transfer.active_clients -= 1
+            picked.active_clients += 1
+        metrics.stream_dc_wait_seconds.observe(timings.dc_wait)
+        metrics.stream_backpressure_seconds.observe(timings.backpressure)
+        log.debug("Sent %d bytes of %s in %.2fs: %.2fs waiting on DC %d, %.2fs on the client",
+                  offset - from_bytes, file.file_name, time.monotonic() - started, timings.dc_wait,
+                  file.dc_id, timings.backpressure)
 
 @routes.get("/")
 async def handle_root(_: web.Request):
-    return web.json_response({key: [val.active_clients, val.users] for key, val in multi_clients.items()})
+    return web.json_response({key: [val.active_clients, val.users, val.buffered_parts]
+                              for key, val in multi_clients.items()})
+
+@routes.get("/metrics")
+async def handle_metrics(_: web.Request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+@routes.get("/profile")
+async def handle_profile(req: web.Request):
+    if not Config.PROFILER:
+        raise web.HTTPNotFound()
+    if profile_lock.locked():
+        return web.Response(status=429, text="429: A profile is already being taken")
+    try:
+        seconds = float(req.query.get("seconds", 10))
+        interval = float(req.query.get("interval", 0.005))
+    except ValueError:
+        raise web.HTTPBadRequest()
+    # float() accepts "nan" and "inf", which min() and max() would let through
+    if not (math.isfinite(seconds) and math.isfinite(interval)):
+        raise web.HTTPBadRequest()
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    interval = max(interval, 0.001)
+    async with profile_lock:
+        # Sampled from another thread so the loop keeps running, and shows up, while profiled
+        stacks = await asyncio.to_thread(sample_stacks, seconds, interval)
+    return web.Response(text="".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
 
 @routes.get(r"/{msg_id:-?\d+}/{name}")
-async def handle_file_request(req: web.Request) -> web.Response:
+async def handle_file_request(req: web.Request) -> web.StreamResponse:
+    return await limit_file_request(req, int(req.match_info["msg_id"]))
+
+@routes.get(r"/{token:[\w-]+\.[\w-]+}/{name}")
+async def handle_signed_file_request(req: web.Request) -> web.StreamResponse:
+    try:
+        msg_id = verify_link(req.match_info["token"], req.match_info["name"])
+    except ExpiredLink:
+        return web.Response(status=410, text="410: Link Expired")
+    except InvalidLink:
+        return web.Response(status=404, text="404: Not Found")
+    return await limit_file_request(req, msg_id)
+
+def client_ip(req: web.Request) -> str:
+    ip = req.remote or ""
+    if ip not in Config.TRUSTED_PROXIES:
+        return ip
+    # The last address not added by our own proxies is the client, earlier ones can be forged
+    for hop in reversed(",".join(req.headers.getall(hdrs.X_FORWARDED_FOR, ())).split(",")):
+        hop = hop.strip()
+        if not hop:
+            break
+        ip = hop
+        if ip not in Config.TRUSTED_PROXIES:
+            break
+    return ip
+
+async def limit_file_request(req: web.Request, msg_id: int) -> web.StreamResponse:
+    if req.method == "HEAD":
+        return await serve_file(req, msg_id, None)
+    flow = stream_limiter.open(client_ip(req), msg_id)
+    if flow is None:
+        return web.Response(status=429, text="429: Too Many Requests", headers={"Retry-After": "1"})
+    try:
+        return await serve_file(req, msg_id, flow)
+    finally:
+        stream_limiter.close(flow)
+
+async def serve_file(req: web.Request, msg_id: int, flow: Optional[Flow]) -> web.StreamResponse:
+    started = time.monotonic()
     head: bool = req.method == "HEAD"
-    msg_id = int(req.match_info["msg_id"])
     file_name = req.match_info["name"]
 
     transfer = None
     client_id = None
 
     async with client_selection_lock:
-        client_id = min(multi_clients, key=lambda k: multi_clients[k].active_clients)
+        stored = file_store.peek(msg_id)
+        client_id = select_client(stored.dc_id if stored else None)
         transfer = multi_clients[client_id]
         if not head:
             transfer.active_clients += 1
         log.debug("Selected client %d for %s. Active downloads for this client: %d", client_id, file_name, transfer.active_clients)
 
-    file: FileInfo = await transfer.get_file(msg_id, file_name)
-    if not file:
-        log.warning("File not found for msg_id %d, name %s using client %d", msg_id, file_name, client_id)
-        return web.Response(status=404, text="404: Not Found")
+    try:
+        file: FileInfo = await transfer.get_file(msg_id, file_name)
+        if not file:
+            log.warning("File not found for msg_id %d, name %s using client %d", msg_id, file_name, client_id)
+            return web.Response(status=404, text="404: Not Found")
+
+        size = file.file_size
+        try:
+            http_range = req.http_range
+        except ValueError:
+            # Malformed or backwards ("bytes=5-2") ranges can't be satisfied
+            http_range = slice(size, None)
+        from_bytes = http_range.start or 0
+        until_bytes = (http_range.stop or size) - 1
+        if from_bytes < 0 and http_range.stop is None:
+            # Suffix range ("bytes=-N"), the last N bytes of the file
+            from_bytes = max(0, size + from_bytes)
+        # A last byte past the end of the file is satisfiable and means "until the end"
+        until_bytes = min(until_bytes, size - 1)
 
-    size = file.file_size
-    from_bytes = req.http_range.start or 0
-    until_bytes = (req.http_range.stop or size) - 1
-
-    if (until_bytes >= size) or (from_bytes < 0) or (until_bytes < from_bytes):
-        return web.Response(status=416, headers={"Content-Range": f"bytes */{size}"})
-
-    if head:
-        body=None
-    else:
-        body=transfer.download(file.location, file.dc_id, size, from_bytes, until_bytes)
-
-    return web.Response(
-        status=200 if (from_bytes == 0 and until_bytes == size - 1) else 206,
-        body=body,
-        headers={
-        "Content-Type": file.mime_type,
-        "Content-Range": f"bytes {from_bytes}-{until_bytes}/{size}",
-        "Content-Length": str(until_bytes - from_bytes + 1),
-        "Content-Disposition": f'attachment; filename="{file_name}"',
-        "Accept-Ranges": "bytes",
-    })
+        if (from_bytes >= size) or (from_bytes < 0) or (until_bytes < from_bytes):
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+
+        headers = {
+            "Content-Type": file.mime_type,
+            "Content-Range": f"bytes {from_bytes}-{until_bytes}/{size}",
+            "Content-Length": str(until_bytes - from_bytes + 1),
+            "Content-Disposition": f'attachment; filename="{file_name}"',
+            "Accept-Ranges": "bytes",
+        }
+        status = 200 if (from_bytes == 0 and until_bytes == size - 1) else 206
+
+        if head:
+            return web.Response(status=status, headers=headers)
+
+        resp = web.StreamResponse(status=status, headers=headers)
+        await resp.prepare(req)
+        body = stream_file(transfer, msg_id, file, from_bytes, until_bytes, started, flow)
+        try:
+            async for chunk in body:
+                if flow.bucket:
+                    await flow.bucket.consume(len(chunk))
+                # write() waits for the transport to drain, so slow clients hold back the download
+                await resp.write(chunk)
+        finally:
+            await body.aclose()
+        await resp.write_eof()
+        return resp
+    finally:
+        if not head:
+            transfer.active_clients -= 1
@@ -0,0 +1,64 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import logging
+import threading
+
+from typing import Any, Awaitable, Coroutine, List, Optional, TypeVar
+
+from telethon.crypto import aes, libssl
+
+from tgfs.config import Config
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class SenderThread:
+    # An event loop running in its own thread. MTProto senders created on it read, decrypt and
+    # parse their responses there, so large parts don't hold up the loop serving HTTP clients.
+    loop: asyncio.AbstractEventLoop
+    thread: threading.Thread
+
+    def __init__(self, name: str) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> Awaitable[T]:
+        # Cancelling the returned future cancels the coroutine on the sender thread as well
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+def crypto_backend() -> str:
+    if aes.cryptg:
+        return "cryptg"
+    if libssl.decrypt_ige:
+        return "libssl"
+    return "python"
+
+sender_threads: List[SenderThread] = [SenderThread(f"tgfs-sender-{i}") for i in range(Config.SENDER_THREADS)]
+_next_thread = itertools.cycle(sender_threads)
+
+def next_sender_thread() -> Optional[SenderThread]:
+    return next(_next_thread) if sender_threads else None
+
+if sender_threads:
+    log.info("Running DC connections on %d sender threads with %s AES", len(sender_threads), crypto_backend())
+    if crypto_backend() == "python":
+        log.warning("Neither cryptg nor libssl is available, decryption holds the GIL and sender threads"
+                    " won't run in parallel, install cryptg")
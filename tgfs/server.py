@@ -0,0 +1,110 @@
+# TG-FileStream
+# Copyright (C) 2025 Deekshith SH
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import multiprocessing
+import os
+import signal
+
+from typing import List
+
+from aiohttp import web
+
+from tgfs import metrics
+from tgfs.config import Config
+from tgfs.log import log
+from tgfs.profiling import monitor_loop_lag
+from tgfs.routes import handle_metrics, routes
+from tgfs.telegram import client, load_plugins, multi_clients, start_clients
+
+async def serve(worker: int, workers: int) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    lag_monitor = asyncio.create_task(monitor_loop_lag())
+    metrics.const_labels["worker"] = str(worker)
+
+    if worker == 0:
+        await client.start(bot_token=Config.BOT_TOKEN)
+        load_plugins("tgfs/plugins")
+    await start_clients(worker, workers)
+    if not multi_clients:
+        log.error("Worker %d has no bot to serve files with", worker)
+        return
+
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # With SO_REUSEPORT every worker listens on the same port and the kernel spreads connections
+    site = web.TCPSite(runner, Config.HOST, int(Config.PORT), reuse_port=workers > 1)
+    await site.start()
+    log.info("Worker %d serving with %d bots on %s:%s", worker, len(multi_clients), Config.HOST, Config.PORT)
+
+    # A scrape of the shared port reaches whichever worker the kernel picks, so every worker also
+    # answers on a port of its own
+    metrics_runner = None
+    if Config.METRICS_PORT:
+        metrics_app = web.Application()
+        metrics_app.router.add_get("/metrics", handle_metrics)
+        metrics_runner = web.AppRunner(metrics_app)
+        await metrics_runner.setup()
+        await web.TCPSite(metrics_runner, Config.HOST, Config.METRICS_PORT + worker).start()
+
+    try:
+        await stop.wait()
+    finally:
+        lag_monitor.cancel()
+        await runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await asyncio.gather(*[transfer.close_connection() for transfer in multi_clients.values()])
+        await asyncio.gather(*[transfer.client.disconnect() for transfer in multi_clients.values()])
+
+def run_worker(worker: int, workers: int) -> None:
+    asyncio.run(serve(worker, workers))
+
+def main() -> None:
+    # Each bot belongs to exactly one worker, so there can't be more workers than bots
+    workers = min(Config.WORKERS, 1 + len(Config.TOKENS))
+    if workers < Config.WORKERS:
+        log.warning("WORKERS=%d but only %d bots are configured, starting %d workers",
+                    Config.WORKERS, 1 + len(Config.TOKENS), workers)
+    if workers > 1 and not Config.FILE_STORE_PATH:
+        log.warning("FILE_STORE_PATH is not set, every worker will resolve file info on its own")
+
+    # Spawned workers import tgfs afresh and pick up their WORKER_ID from the environment
+    ctx = multiprocessing.get_context("spawn")
+    processes: List[multiprocessing.Process] = []
+    for worker in range(1, workers):
+        os.environ["WORKER_ID"] = str(worker)
+        process = ctx.Process(target=run_worker, args=(worker, workers), name=f"tgfs-worker-{worker}")
+        process.start()
+        processes.append(process)
+    os.environ.pop("WORKER_ID", None)
+
+    try:
+        run_worker(0, workers)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    main()
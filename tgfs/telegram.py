@@ -19,7 +19,7 @@ import importlib.util
 import logging
 
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from telethon import TelegramClient, functions
 from telethon.sessions import MemorySession
 from telethon.tl.types import InputPeerUser
@@ -29,11 +29,12 @@ from tgfs.paralleltransfer import ParallelTransferrer
 
 log = logging.getLogger(__name__)
 
+# Only worker 0 logs in as the main bot, the session file can't be shared between processes
 client = TelegramClient(
-    "tg-filestream",
+    "tg-filestream" if Config.WORKER_ID == 0 else MemorySession(),
     api_id=Config.API_ID,
     api_hash=Config.API_HASH,
-    receive_updates=not Config.NO_UPDATE
+    receive_updates=not Config.NO_UPDATE and Config.WORKER_ID == 0
 )
 multi_clients: Dict[int, ParallelTransferrer] = {}
 
@@ -62,11 +63,16 @@ async def _start_client(token: str) -> Tuple[Optional[ParallelTransferrer], Opti
         log.error("Faied to Start Client %s: %s", token.split(":")[0], e)
         return None, None
 
-async def start_clients():
-    me: InputPeerUser = await client.get_me(True)
-    multi_clients[me.user_id] = ParallelTransferrer(client, me.user_id)
-    multi_clients[me.user_id].post_init()
-    task = [_start_client(token) for token in Config.TOKENS]
+def worker_tokens(worker: int, workers: int) -> List[str]:
+    # The main bot counts as bot 0 and belongs to worker 0, the rest are dealt out round robin
+    return Config.TOKENS[(worker - 1) % workers::workers]
+
+async def start_clients(worker: int = 0, workers: int = 1):
+    if worker == 0:
+        me: InputPeerUser = await client.get_me(True)
+        multi_clients[me.user_id] = ParallelTransferrer(client, me.user_id)
+        multi_clients[me.user_id].post_init()
+    task = [_start_client(token) for token in worker_tokens(worker, workers)]
     result = await asyncio.gather(*task)
     multi_clients.update({
         uid: transfer
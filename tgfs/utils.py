@@ -14,7 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Optional, Union, cast
+import asyncio
+import logging
+from typing import Dict, List, Optional, Union, cast
 from dataclasses import dataclass
 from telethon import TelegramClient
 from telethon.utils import get_input_location
@@ -24,6 +26,8 @@ from telethon.events import NewMessage
 
 from tgfs.config import Config
 
+log = logging.getLogger(__name__)
+
 InputTypeLocation = Union[types.InputDocumentFileLocation, types.InputPhotoFileLocation]
 
 @dataclass
@@ -46,8 +50,73 @@ def get_filename(message: Union[Message, NewMessage.Event]) -> str:
     ext = message.file.ext or ""
     return f"{file.id}{ext}"
 
+class MessageBatcher:
+    # Collects the message IDs asked for during RESOLVE_BATCH_DELAY and fetches them with
+    # a single get_messages call, so a burst of new links doesn't turn into a burst of RPCs.
+    client: TelegramClient
+    delay: float
+    pending: Dict[int, List[asyncio.Future]]
+    _task: Optional[asyncio.Task]
+
+    def __init__(self, client: TelegramClient, delay: float) -> None:
+        self.client = client
+        self.delay = delay
+        self.pending = {}
+        self._task = None
+
+    def get(self, msg_id: int) -> "asyncio.Future[Optional[Message]]":
+        future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(msg_id, []).append(future)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+        return future
+
+    async def _flush(self) -> None:
+        pending: Dict[int, List[asyncio.Future]] = {}
+        error: Optional[BaseException] = None
+        try:
+            await asyncio.sleep(self.delay)
+            pending, self.pending = self.pending, {}
+            self._task = None
+            ids = list(pending)
+            messages = await self.client.get_messages(Config.BIN_CHANNEL, ids=ids)
+            log.debug("Fetched %d messages in one request", len(ids))
+            for msg_id, message in zip(ids, messages):
+                for future in pending[msg_id]:
+                    if not future.done():
+                        future.set_result(message)
+        except Exception as e:
+            error = e
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if self._task is asyncio.current_task():
+                # Stopped before taking the batch, requests made from now on start a new one
+                pending, self.pending = self.pending, {}
+                self._task = None
+            # Nobody else will resolve these, ids missing from the result are not found
+            for futures in pending.values():
+                for future in futures:
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    elif isinstance(error, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(error)
+
+_batchers: Dict[TelegramClient, MessageBatcher] = {}
+
+def get_message(client: TelegramClient, msg_id: int) -> "asyncio.Future[Optional[Message]]":
+    batcher = _batchers.get(client)
+    if batcher is None:
+        batcher = _batchers[client] = MessageBatcher(client, Config.RESOLVE_BATCH_DELAY / 1000)
+    return batcher.get(msg_id)
+
 async def get_fileinfo(client: TelegramClient, msg_id: int, file_name: str) -> Optional[FileInfo]:
-    message = cast(Message, await client.get_messages(Config.BIN_CHANNEL, ids=msg_id))
+    message = cast(Message, await get_message(client, msg_id))
     if not message or not message.file or get_filename(message) != file_name:
         return None
     media: InputTypeLocation = message.media